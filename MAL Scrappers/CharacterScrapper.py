@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
-from dbScrapperV4 import dbScrapper
+from dbScrapperV4 import dbScrapper, checkpointJournal, logSetup
 from os import mkdir
-import json
 import argparse
 import logging
 
@@ -17,63 +16,51 @@ try:
 except:
     pass
 
-# configure logging
-logging.basicConfig(filename="logs/CharacterScrapper.log", \
-    format="%(asctime)s (%(levelname)s): %(message)s", \
-        datefmt='%d/%m/%Y (%a) %H:%M:%S >> ', level=logging.DEBUG)
-
 # define console parameters to be parsed
 parser = argparse.ArgumentParser()
 parser.add_argument("-s", "--start", help="Specify an Id to start from", type=int)
 parser.add_argument("-c", "--cycle", help="Specify a cycle delay", type=float)
+parser.add_argument("-p", "--prefetch", help="Specify how many upcoming Ids to fetch ahead concurrently", type=int, default=0)
+parser.add_argument("--replay", help="Serve every request from the response cache of the config instead of the API", action="store_true")
+parser.add_argument("-q", "--quiet", help="Don't print the progress of every entry", action="store_true")
+parser.add_argument("-l", "--log-level", help="Specify the minimum level of the logged messages", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="DEBUG")
 args = parser.parse_args()
 
+# configure logging through a queue into a rotating and compressed log file
+logSetup("logs/CharacterScrapper.log", args.log_level)
+
 # files paths
-statusFile = "config/status.json"
+journalFile = "config/status-character.journal"
 dbConfigFile = "config/scrapper-conf-V4-character.json"
 
-# if parameters parsed then define variables, if not read status file
+# load the checkpoint journal with the previus program status, starting a new pass if the last one finished
+journal = checkpointJournal(journalFile)
+logging.debug("Checkpoint journal opened")
+print("Checkpoint journal opened!")
+if journal.finished:
+    logging.debug("Last pass finished, starting a new one")
+    print("Last pass finished! Starting a new one...")
+    journal.reset()
+finished = journal.finished
+maxId = journal.maxId
+logging.info(f"Completed Ids: {journal.count()}, Max Id: {maxId}")
+
+# if parameters parsed then start from them, if not start from the first Id not completed
 if args.start:
-    finished = False
     lastId = args.start
     logging.debug(f"Got lastId = {lastId} from parsed argument!")
     print(f"-> Got lastId = {lastId} from parsed argument!")
 else:
-    # load status file to check for previus program status
-    while True:
-        try:
-            with open(statusFile, "r") as file:
-                logging.debug("Status file opened")
-                print("Status file opened!")
-                status = file.read()
-                # if file content is not spaces and its length is grater than 0 then read content
-                if not status.isspace() and len(status) > 0:
-                    status = json.loads(status)
-                    statusKeys = status.keys()
-                    # if the needed keys are within the content then continue
-                    if "finished" in statusKeys and "lastId" in statusKeys and "maxId" in statusKeys:
-                        # if the finished parameter is False then continue
-                        if not status["finished"]:
-                            finished = status["finished"]
-                            lastId = status["lastId"]
-                            maxId = status["maxId"]
-                            logging.info(f"Finished: {finished}, LastId: {lastId}, Max Id: {maxId}")
-                            #print(finished, lastId)
-                            break
-                # if something fails raise an error
-                raise FileNotFoundError
-        # if the FileNotFound is raised then create a fresh status file with default parameters
-        except FileNotFoundError:
-            logging.debug("Status file not found or unusable")
-            print("Status file not found or unusable!")
-            with open(statusFile, "w") as file:
-                logging.debug("Creating status file")
-                print("Creating status file...")
-                file.write(json.dumps({"finished":False, "lastId":0, "maxId":50000}, indent=4))
+    lastId = 0
 
 # create a dbScrapper object
 logging.debug("Creating dbScrapper object")
-characterScrapper = dbScrapper(dbConfigFile, args.cycle)
+characterScrapper = dbScrapper(dbConfigFile, args.cycle, replay=args.replay, quiet=args.quiet)
+
+# character Ids can not be looked up, scrap up to 50000 if not set manually
+if not maxId:
+    maxId = 50000
+    journal.setMax(maxId)
 
 # if finished is false then continue
 if not finished:
@@ -81,11 +68,10 @@ if not finished:
     print(f"Scrapping character data from Id: {lastId} to Id: {maxId}")
     try:
         # scrap data from lastId to maxId
-        for x in range(lastId, maxId):
+        for x, characterData in characterScrapper.dataFeed(journal.todo(lastId, maxId), args.prefetch):
+            logging.debug("Got Id: %s data", x)
             # bucle until characterData gets valid data to evaluate
             while True:
-                logging.debug(f"Getting Id: {x} data")
-                characterData = characterScrapper.dataGet(x)
                 # if characterData has valid data, insert it into the database and update the status file
                 if characterData:
                     logging.debug("Valid data")
@@ -98,23 +84,36 @@ if not finished:
                 elif characterData is False:
                     logging.debug("Invalid data")
                     break
-            # update status
-            with open(statusFile, "w") as status:
-                logging.debug("Updating status file")
-                status.write(json.dumps({"finished":False, "lastId":x, "maxId":maxId}, indent=4))
+                # service was not available, request the same Id again after the backoff delay of the retry policy
+                logging.debug("Getting Id: %s data again", x)
+                characterData = characterScrapper.dataRetry(x)
+                # the retry budget of the Id was spent, leave it uncompleted for the next pass
+                if characterData is None: break
+            if characterData is None:
+                logging.warning("Retry budget of Id: %s spent, skipping it", x)
+                continue
+            # mark the Id as completed, it is made durable once no entries are queued for the database
+            journal.done(x)
+            if not characterScrapper.batchRows: journal.sync()
     except Exception as e:
         error = "An error occurred while running the program!\nError: "+str(e)+"\nTerminating program..."
         logging.error(error)
         print(error)
+        # write whatever is still queued and its completed Ids before terminating
+        try:
+            characterScrapper.dataFlush()
+            journal.close()
+        except: pass
         exit()
-    # when the maxId has been reached, update the finished parameter to True within the status file
-    with open(statusFile, "w") as status:
-        logging.debug("Update status file to finished")
-        status.write(json.dumps({"finished":True, "lastId":x, "maxId":maxId}, indent=4))
+    # when the maxId has been reached, mark the pass as finished within the checkpoint journal
+    characterScrapper.dataFlush()
+    logging.debug("Update checkpoint journal to finished")
+    journal.finish()
 
 # close the database connection when everything has finished
 logging.debug("Closing database connection")
 characterScrapper.closeConnection()
+journal.close()
 
 # print finished message
 logging.info("Scrapping is finished!")
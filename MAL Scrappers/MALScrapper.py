@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+from dbScrapperV4 import dbScrapper, dbPool, rateLimiter, httpSession, checkpointJournal, scrapMetrics, logSetup, leaseTable, retryPolicy
+from threading import Thread
+from os import mkdir, path
+import json
+import argparse
+import logging
+
+# create config folder
+try:
+    mkdir("config/")
+except:
+    pass
+
+# create logs folder
+try:
+    mkdir("logs/")
+except:
+    pass
+
+# define console parameters to be parsed
+parser = argparse.ArgumentParser()
+parser.add_argument("configs", help="Specify the dbScrapper config files to scrap (one per entity type)", nargs="*", \
+    default=["config/scrapper-conf-V4-anime.json", "config/scrapper-conf-V4-manga.json", "config/scrapper-conf-V4-character.json"])
+parser.add_argument("-c", "--cycle", help="Specify a cycle delay shared by every entity type", type=float)
+parser.add_argument("-p", "--prefetch", help="Specify how many upcoming Ids to fetch ahead concurrently per entity type", type=int, default=0)
+parser.add_argument("--replay", help="Serve every request from the response cache of the configs instead of the API", action="store_true")
+parser.add_argument("-r", "--refresh", help="Refresh the N known entries of each entity type most likely to have changed instead of scrapping the Id range", type=int)
+parser.add_argument("-m", "--max-id", help="Specify the max Id to scrap up to instead of getting it from the Jikan API", type=int)
+parser.add_argument("--lease", help="Claim the Id ranges to scrap from the lease table of the database, so several workers can share a pass", action="store_true")
+parser.add_argument("-q", "--quiet", help="Don't print the progress of every entry", action="store_true")
+parser.add_argument("-l", "--log-level", help="Specify the minimum level of the logged messages", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="DEBUG")
+args = parser.parse_args()
+
+# configure logging through a queue into a rotating and compressed log file
+logSetup("logs/MALScrapper.log", args.log_level)
+
+# urls to get the max mal_id of each entity type, entity types not listed here use defaultMaxId
+maxIdUrls = {
+    "anime": "https://api.jikan.moe/v3/search/anime?q=&limit=1&order_by=id",
+    "manga": "https://api.jikan.moe/v3/search/manga?q=&limit=1&order_by=id"
+}
+defaultMaxId = 50000
+
+# entity type of a config file named like scrapper-conf-V4-<entity>.json
+def entityName(configFile):
+    return path.splitext(path.basename(configFile))[0].split("-")[-1]
+
+# get the max mal_id of an entity type from the MAL site if not set manually
+def entityMaxId(name, scrapper):
+    if args.max_id:
+        maxId = args.max_id
+    elif name in maxIdUrls:
+        logging.debug(f"Getting {name} max Id from Jikan API")
+        maxId = scrapper.httpGet(maxIdUrls[name]).json()["results"][0]["mal_id"]+1
+    else:
+        maxId = defaultMaxId
+    logging.info(f"{name} max Id: {maxId}")
+    return maxId
+
+# scrap every Id of an entity type not completed yet in its checkpoint journal, up to its max Id
+def scrapEntity(name, scrapper, journalFile):
+    journal = checkpointJournal(journalFile)
+    if journal.finished:
+        logging.debug(f"Last {name} pass finished, starting a new one")
+        print(f"Last {name} pass finished! Starting a new one...")
+        journal.reset()
+    maxId = journal.maxId
+    # get the max mal_id from the MAL site if not set manually
+    if not maxId:
+        maxId = entityMaxId(name, scrapper)
+        journal.setMax(maxId)
+    logging.debug(f"Scrapping {name} data up to Id: {maxId} ({journal.count()} Ids completed)")
+    print(f"Scrapping {name} data up to Id: {maxId} ({journal.count()} Ids completed)")
+    try:
+        for x, data in scrapper.dataFeed(journal.todo(0, maxId), args.prefetch):
+            # bucle until data is valid to evaluate
+            while True:
+                if data:
+                    if scrapper.dataInsert(data):
+                        logging.debug("%s Id: %s inserted succesfully into database", name, x)
+                    else:
+                        logging.error("Error while inserting %s Id: %s into database!", name, x)
+                    break
+                elif data is False:
+                    logging.debug("Invalid %s Id: %s data", name, x)
+                    break
+                # service was not available, request the same Id again after the backoff delay of the retry policy
+                data = scrapper.dataRetry(x)
+                # the retry budget of the Id was spent, leave it uncompleted for the next pass
+                if data is None: break
+            if data is None:
+                logging.warning("Retry budget of %s Id: %s spent, skipping it", name, x)
+                continue
+            # the completed Id is made durable once no entries are queued for the database
+            journal.done(x)
+            if not scrapper.batchRows: journal.sync()
+        scrapper.dataFlush()
+    except Exception as e:
+        error = f"An error occurred while scrapping {name}!\nError: {e}\nStopping {name}..."
+        logging.error(error)
+        print(error)
+        try:
+            scrapper.dataFlush()
+            journal.close()
+        except: pass
+        return
+    journal.finish()
+    journal.close()
+    logging.info(f"{name} scrapping is finished!")
+    print(f"{name} scrapping is finished!")
+    return
+
+# scrap the Id ranges of an entity type leased from the lease table until every range of the pass is completed
+# a range whose lease is lost (expired and claimed by another worker) is left to that worker
+def leaseEntity(name, scrapper, lease):
+    try:
+        maxId = entityMaxId(name, scrapper)
+        if lease.reset():
+            print(f"Last {name} pass finished! Starting a new one...")
+        lease.plan(maxId)
+        while lease.claim():
+            logging.debug(f"Leased {name} Ids {lease.start} to {lease.end - 1} from Id: {lease.next}")
+            print(f"Leased {name} Ids {lease.start} to {lease.end - 1} from Id: {lease.next}")
+            lost = False
+            for x, data in scrapper.dataFeed(range(lease.next, min(lease.end, maxId)), args.prefetch):
+                while True:
+                    if data:
+                        if not scrapper.dataInsert(data):
+                            logging.error("Error while inserting %s Id: %s into database!", name, x)
+                        break
+                    elif data is False:
+                        break
+                    data = scrapper.dataRetry(x)
+                    if data is None:
+                        logging.warning("Retry budget of %s Id: %s spent, skipping it", name, x)
+                        break
+                # the progress reported is only the Ids already written to the database
+                if not lease.beat(None if scrapper.batchRows else x + 1):
+                    lost = True
+                    break
+            scrapper.dataFlush()
+            if not lost: lease.complete()
+    except Exception as e:
+        error = f"An error occurred while scrapping {name}!\nError: {e}\nStopping {name}..."
+        logging.error(error)
+        print(error)
+        try:
+            scrapper.dataFlush()
+            lease.release()
+        except: pass
+        return
+    logging.info(f"{name} leased ranges are finished!")
+    print(f"{name} leased ranges are finished!")
+    return
+
+# refresh the count entries of an entity type most likely to have changed (needs a fingerprint store)
+# the ids come in priority order, so every entry is looked up on its own instead of through the preload window
+def refreshEntity(name, scrapper, count):
+    ids = scrapper.refreshQueue(count)
+    logging.debug(f"Refreshing {len(ids)} {name} entries")
+    print(f"Refreshing {len(ids)} {name} entries...")
+    try:
+        for x, data in scrapper.dataFeed(ids, args.prefetch):
+            while True:
+                if data:
+                    if not scrapper.dataInsert(data, False):
+                        logging.error("Error while refreshing %s Id: %s into database!", name, x)
+                    break
+                elif data is False:
+                    break
+                data = scrapper.dataRetry(x)
+                if data is None:
+                    logging.warning("Retry budget of %s Id: %s spent, skipping it", name, x)
+                    break
+        scrapper.dataFlush()
+    except Exception as e:
+        error = f"An error occurred while refreshing {name}!\nError: {e}\nStopping {name}..."
+        logging.error(error)
+        print(error)
+        return
+    logging.info(f"{name} refresh is finished!")
+    print(f"{name} refresh is finished!")
+    return
+
+# shared http session, rate budget and one connection pool per database server
+confs = {}
+for configFile in args.configs:
+    with open(configFile, "r") as file:
+        confs[configFile] = json.loads(file.read())
+session = httpSession(max(c.get("http", {}).get("poolSize", 10) for c in confs.values()))
+if args.cycle:
+    limiter = rateLimiter(1 / args.cycle)
+else:
+    # the strictest configured budget is shared by every entity type
+    rates = [c["rateLimit"] if "rateLimit" in c else {"rate": 1 / c["delay"]} for c in confs.values()]
+    limiter = rateLimiter(min(r["rate"] for r in rates), min(r.get("burst", 1) for r in rates))
+pools = {}
+for conf in confs.values():
+    key = json.dumps(conf["database"], sort_keys=True)
+    if key not in pools:
+        pools[key] = dbPool(conf["database"])
+# one metrics exporter labelling the stats of every entity type by table, configured by the first config with a metrics block
+metricsConf = next((c["metrics"] for c in confs.values() if c.get("metrics", {}).get("port") or c.get("metrics", {}).get("file")), {})
+metrics = scrapMetrics(metricsConf.get("port", 0), metricsConf.get("file", ""), metricsConf.get("interval", 10))
+
+# one retry policy whose circuit breaker pauses the requests of every entity type while the api is down, configured by the first config with a retry block
+retryConf = next((c["retry"] for c in confs.values() if "retry" in c), {})
+retry = retryPolicy(retryConf.get("base", 1), retryConf.get("cap", 60), retryConf.get("budgets", False), \
+    retryConf.get("threshold", 5), retryConf.get("cooldown", 30), retryConf.get("maxCooldown", 300))
+
+# create one dbScrapper object per entity type and scrap all of them at once
+workers = []
+scrappers = []
+for configFile, conf in confs.items():
+    name = entityName(configFile)
+    logging.debug(f"Creating {name} dbScrapper object")
+    scrapper = dbScrapper(configFile, session=session, pool=pools[json.dumps(conf["database"], sort_keys=True)], limiter=limiter, replay=args.replay, metrics=metrics, quiet=args.quiet, retry=retry)
+    scrappers.append(scrapper)
+    if args.refresh:
+        workers.append(Thread(target=refreshEntity, args=(name, scrapper, args.refresh), name=name))
+    elif args.lease:
+        leaseConf = conf.get("lease", {})
+        lease = leaseTable(scrapper.pool, scrapper.dbTable, leaseConf.get("table", "scrapper_leases"), leaseConf.get("size", 1000), \
+            leaseConf.get("ttl", 300), leaseConf.get("heartbeat", 30))
+        workers.append(Thread(target=leaseEntity, args=(name, scrapper, lease), name=name))
+    else:
+        workers.append(Thread(target=scrapEntity, args=(name, scrapper, f"config/status-{name}.journal"), name=name))
+for w in workers:
+    w.start()
+for w in workers:
+    w.join()
+
+# close the database connections when everything has finished
+logging.debug("Closing database connections")
+for scrapper in scrappers:
+    scrapper.closeConnection()
+for pool in pools.values():
+    pool.close()
+metrics.close()
+session.close()
+
+# print finished message
+logging.info("Scrapping is finished!")
+print("Scrapping is finished!")
@@ -1,8 +1,6 @@
 #!/usr/bin/env python3
-from dbScrapperV4 import dbScrapper
+from dbScrapperV4 import dbScrapper, checkpointJournal, logSetup
 from os import mkdir
-import requests
-import json
 import argparse
 import logging
 
@@ -18,70 +16,53 @@ try:
 except:
     pass
 
-# configure logging
-logging.basicConfig(filename="logs/MangaScrapper.log", \
-    format="%(asctime)s (%(levelname)s): %(message)s", \
-        datefmt='%d/%m/%Y (%a) %H:%M:%S >> ', level=logging.DEBUG)
-
 # define console parameters to be parsed
 parser = argparse.ArgumentParser()
 parser.add_argument("-s", "--start", help="Specify an Id to start from", type=int)
 parser.add_argument("-c", "--cycle", help="Specify a cycle delay", type=float)
+parser.add_argument("-p", "--prefetch", help="Specify how many upcoming Ids to fetch ahead concurrently", type=int, default=0)
+parser.add_argument("--replay", help="Serve every request from the response cache of the config instead of the API", action="store_true")
+parser.add_argument("-q", "--quiet", help="Don't print the progress of every entry", action="store_true")
+parser.add_argument("-l", "--log-level", help="Specify the minimum level of the logged messages", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="DEBUG")
 args = parser.parse_args()
 
+# configure logging through a queue into a rotating and compressed log file
+logSetup("logs/MangaScrapper.log", args.log_level)
+
 # files paths
-statusFile = "config/status.json"
+journalFile = "config/status-manga.journal"
 dbConfigFile = "config/scrapper-conf-V4-manga.json"
 
-# if parameters parsed then define variables, if not read status file
+# load the checkpoint journal with the previus program status, starting a new pass if the last one finished
+journal = checkpointJournal(journalFile)
+logging.debug("Checkpoint journal opened")
+print("Checkpoint journal opened!")
+if journal.finished:
+    logging.debug("Last pass finished, starting a new one")
+    print("Last pass finished! Starting a new one...")
+    journal.reset()
+finished = journal.finished
+maxId = journal.maxId
+logging.info(f"Completed Ids: {journal.count()}, Max Id: {maxId}")
+
+# if parameters parsed then start from them, if not start from the first Id not completed
 if args.start:
-    finished = False
     lastId = args.start
-    maxId = False
     logging.debug(f"Got lastId = {lastId} from parsed argument!")
     print(f"-> Got lastId = {lastId} from parsed argument!")
 else:
-    # load status file to check for previus program status
-    while True:
-        try:
-            with open(statusFile, "r") as file:
-                logging.debug("Status file opened")
-                print("Status file opened!")
-                status = file.read()
-                # if file content is not spaces and its length is grater than 0 then read content
-                if not status.isspace() and len(status) > 0:
-                    status = json.loads(status)
-                    statusKeys = status.keys()
-                    # if the needed keys are within the content then continue
-                    if "finished" in statusKeys and "lastId" in statusKeys:
-                        # if the finished parameter is False then continue
-                        if not status["finished"]:
-                            finished = status["finished"]
-                            lastId = status["lastId"]
-                            maxId = status["maxId"]
-                            logging.info(f"Finished: {finished}, LastId: {lastId}, Max Id: {maxId}")
-                            #print(finished, lastId)
-                            break
-                # if something fails raise an error
-                raise FileNotFoundError
-        # if the FileNotFound is raised then create a fresh status file with default parameters
-        except FileNotFoundError:
-            logging.debug("Status file not found or unusable")
-            print("Status file not found or unusable!")
-            with open(statusFile, "w") as file:
-                logging.debug("Creating status file")
-                print("Creating status file...")
-                file.write(json.dumps({"finished":False, "lastId":0, "maxId":False}, indent=4))
+    lastId = 0
 
 # create a dbScrapper object
 logging.debug("Creating dbScrapper object")
-mangaScrapper = dbScrapper(dbConfigFile, args.cycle)
+mangaScrapper = dbScrapper(dbConfigFile, args.cycle, replay=args.replay, quiet=args.quiet)
 
 # get the max manga mal_id from the MAL site if not set manually
 if not maxId:
     logging.debug("Getting max Id from Jikan API")
-    maxId = requests.get("https://api.jikan.moe/v3/search/manga?q=&limit=1&order_by=id").json()
+    maxId = mangaScrapper.httpGet("https://api.jikan.moe/v3/search/manga?q=&limit=1&order_by=id").json()
     maxId = maxId["results"][0]["mal_id"]+1
+    journal.setMax(maxId)
     logging.info(f"Max Id: {maxId}")
 
 # if finished is false then continue
@@ -90,11 +71,10 @@ if not finished:
     print(f"Scrapping manga data from Id: {lastId} to Id: {maxId}")
     try:
         # scrap data from lastId to maxId
-        for x in range(lastId, maxId):
+        for x, mangaData in mangaScrapper.dataFeed(journal.todo(lastId, maxId), args.prefetch):
+            logging.debug("Got Id: %s data", x)
             # bucle until mangaData gets valid data to evaluate
             while True:
-                logging.debug(f"Getting Id: {x} data")
-                mangaData = mangaScrapper.dataGet(x)
                 # if mangaData has valid data, insert it into the database and update the status file
                 if mangaData:
                     logging.debug("Valid data")
@@ -107,24 +87,37 @@ if not finished:
                 elif mangaData is False:
                     logging.debug("Invalid data")
                     break
-            # update status
-            with open(statusFile, "w") as status:
-                logging.debug("Updating status file")
-                status.write(json.dumps({"finished":False, "lastId":x, "maxId":maxId}, indent=4))
+                # service was not available, request the same Id again after the backoff delay of the retry policy
+                logging.debug("Getting Id: %s data again", x)
+                mangaData = mangaScrapper.dataRetry(x)
+                # the retry budget of the Id was spent, leave it uncompleted for the next pass
+                if mangaData is None: break
+            if mangaData is None:
+                logging.warning("Retry budget of Id: %s spent, skipping it", x)
+                continue
+            # mark the Id as completed, it is made durable once no entries are queued for the database
+            journal.done(x)
+            if not mangaScrapper.batchRows: journal.sync()
     #try: pass
     except Exception as e:
         error = "An error occurred while running the program!\nError: "+str(e)+"\nTerminating program..."
         logging.error(error)
         print(error)
+        # write whatever is still queued and its completed Ids before terminating
+        try:
+            mangaScrapper.dataFlush()
+            journal.close()
+        except: pass
         exit()
-    # when the maxId has been reached, update the finished parameter to True within the status file
-    with open(statusFile, "w") as status:
-        logging.debug("Update status file to finished")
-        status.write(json.dumps({"finished":True, "lastId":x, "maxId":maxId}, indent=4))
+    # when the maxId has been reached, mark the pass as finished within the checkpoint journal
+    mangaScrapper.dataFlush()
+    logging.debug("Update checkpoint journal to finished")
+    journal.finish()
 
 # close the database connection when everything has finished
 logging.debug("Closing database connection")
 mangaScrapper.closeConnection()
+journal.close()
 
 # print finished message
 logging.info("Scrapping is finished!")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# ---------------------------------------------------------------------------
+""" Benchmark of dbScrapper against local stand-ins of the Jikan API and of the
+MySQL server (see fakeJikan.py and fakeDatabase.py), so performance changes
+can be measured without the real services. Runs dataGet, dataExists and
+dataInsert on their own and the full scrapper loop over new, unchanged and
+changed entries, printing the Ids/sec and per stage timings of every run. """
+# ---------------------------------------------------------------------------
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+from time import perf_counter
+from contextlib import redirect_stdout
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dbScrapperV4"))
+from dbScrapperV4 import dbScrapper, dbPool, checkpointJournal, scrapMetrics
+from fakeJikan import fakeJikan
+from fakeDatabase import fakeDatabase, benchTable
+
+# define console parameters to be parsed
+parser = argparse.ArgumentParser()
+parser.add_argument("-i", "--ids", help="Specify how many Ids to scrap in every run", type=int, default=500)
+parser.add_argument("-l", "--latency", help="Specify the api latency in milliseconds", type=float, default=0)
+parser.add_argument("-d", "--db-latency", help="Specify the database latency of every statement in milliseconds", type=float, default=0)
+parser.add_argument("-s", "--payload", help="Specify the synopsis size of every entry in characters", type=int, default=2000)
+parser.add_argument("-n", "--not-found", help="Specify the fraction of missing ids", type=float, default=0.2)
+parser.add_argument("-p", "--prefetch", help="Specify how many upcoming Ids to fetch ahead concurrently", type=int, default=0)
+parser.add_argument("-b", "--batch", help="Specify the batch size of the database writes", type=int, default=0)
+parser.add_argument("--preload", help="Specify the preload window of existing rows", type=int, default=0)
+parser.add_argument("--verify", help="Specify the verification policy of the writes (full, rowcount or sample:N)", default="full")
+parser.add_argument("--fingerprints", help="Use a fingerprint store", action="store_true")
+parser.add_argument("--seed", help="Specify the seed the api entries are generated from", type=int, default=0)
+parser.add_argument("-o", "--output", help="Write the results as json to this file")
+parser.add_argument("-v", "--verbose", help="Show the output of dbScrapper", action="store_true")
+args = parser.parse_args()
+
+# stand-ins and config of the benchmark in a temporary folder
+workdir = tempfile.mkdtemp(prefix="dbBenchmark-")
+api = fakeJikan(args.latency / 1000, args.payload, args.not_found, args.seed)
+api.start()
+database = fakeDatabase(os.path.join(workdir, "benchmark.db"), ["anime"], args.db_latency / 1000)
+conf = {
+    "api": f"{api.url}/anime",
+    "database": {"host": "benchmark", "port": 3306, "user": "", "password": "", "database": "", "poolSize": max(4, args.prefetch), "ping": 30},
+    "table": "anime",
+    "dbUnique": "mal_id",
+    "columns": {c: c for c in benchTable},
+    "delay": 0,
+    "rateLimit": {"rate": 1000000, "burst": 1000000},
+    "http": {"timeout": [5, 30], "poolSize": max(10, args.prefetch)},
+    "batch": {"size": args.batch, "interval": 5},
+    "preload": args.preload,
+    "fingerprints": os.path.join(workdir, "fingerprints.db") if args.fingerprints else "",
+    "verify": args.verify
+}
+configFile = os.path.join(workdir, "scrapper-conf-V4-anime.json")
+with open(configFile, "w") as file:
+    file.write(json.dumps(conf, indent=4))
+output = sys.stdout if args.verbose else open(os.devnull, "w")
+
+# dbScrapper object on the database stand-in with its own metrics
+def newScrapper():
+    with redirect_stdout(output):
+        return dbScrapper(configFile, pool=dbPool(conf["database"], connect=database.connect), metrics=scrapMetrics())
+
+def closeScrapper(scrapper):
+    with redirect_stdout(output):
+        scrapper.closeConnection()
+        scrapper.pool.close()
+        scrapper.metrics.close()
+    return
+
+# time function over every item, returning the results of a run
+def timeRun(name, scrapper, function, items):
+    start = perf_counter()
+    with redirect_stdout(output):
+        results = [function(i) for i in items]
+        scrapper.dataFlush()
+    return runResult(name, scrapper, len(items), perf_counter() - start), results
+
+# scrap every Id not completed in journal the same way the scrappers do
+def scrapLoop(scrapper, journal):
+    for x, data in scrapper.dataFeed(journal.todo(1, args.ids + 1), args.prefetch):
+        while True:
+            if data:
+                scrapper.dataInsert(data)
+                break
+            elif data is False:
+                break
+            data = scrapper.dataRetry(x)
+            if data is None: break
+        if data is None: continue
+        journal.done(x)
+        if not scrapper.batchRows: journal.sync()
+    scrapper.dataFlush()
+    journal.finish()
+    return
+
+def loopRun(name):
+    scrapper = newScrapper()
+    journal = checkpointJournal(os.path.join(workdir, "status-anime.journal"))
+    journal.reset()
+    start = perf_counter()
+    with redirect_stdout(output):
+        scrapLoop(scrapper, journal)
+    result = runResult(name, scrapper, args.ids, perf_counter() - start)
+    journal.close()
+    closeScrapper(scrapper)
+    return result
+
+def runResult(name, scrapper, ids, elapsed):
+    stats = scrapper.metrics.snapshot()["tables"].get(scrapper.dbTable, {"counters": {}, "stages": {}})
+    return {"name": name, "ids": ids, "seconds": elapsed, "idsPerSecond": ids / elapsed if elapsed else 0, "counters": stats["counters"], "stages": stats["stages"]}
+
+def printResult(result):
+    print(f"\n{result['name']}: {result['ids']} Ids in {result['seconds']:.3f}s -> {result['idsPerSecond']:.1f} Ids/sec")
+    print("\t" + ", ".join(f"{k}: {v}" for k, v in sorted(result["counters"].items())))
+    print(f"\t{'stage':<10}{'count':>8}{'avg ms':>10}{'total s':>10}")
+    for stage, s in result["stages"].items():
+        print(f"\t{stage:<10}{s['count']:>8}{s['average'] * 1000:>10.3f}{s['seconds']:>10.3f}")
+    return
+
+print(f"Benchmarking {args.ids} Ids (api latency {args.latency}ms, db latency {args.db_latency}ms, payload {args.payload}, not found {args.not_found}, prefetch {args.prefetch}, batch {args.batch}, verify {args.verify})")
+results = []
+try:
+    # dbScrapper functions on their own, each run with its own object
+    scrapper = newScrapper()
+    result, entries = timeRun("dataGet", scrapper, scrapper.dataGet, range(1, args.ids + 1))
+    results.append(result)
+    closeScrapper(scrapper)
+    entries = [e for e in entries if type(e) is dict]
+    scrapper = newScrapper()
+    results.append(timeRun("dataExists", scrapper, scrapper.dataExists, entries)[0])
+    closeScrapper(scrapper)
+    scrapper = newScrapper()
+    results.append(timeRun("dataInsert", scrapper, scrapper.dataInsert, entries)[0])
+    closeScrapper(scrapper)
+    # full scrapper loop over new, unchanged and changed entries
+    scrapper = newScrapper()
+    scrapper.pool.execute("DELETE FROM `anime`", prepared=False)
+    closeScrapper(scrapper)
+    if args.fingerprints: os.remove(conf["fingerprints"])
+    results.append(loopRun("loop (new entries)"))
+    results.append(loopRun("loop (unchanged entries)"))
+    api.version += 1
+    results.append(loopRun("loop (changed entries)"))
+finally:
+    api.close()
+    shutil.rmtree(workdir)
+
+for result in results:
+    printResult(result)
+if args.output:
+    with open(args.output, "w") as file:
+        file.write(json.dumps({"args": vars(args), "results": results}, indent=4))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# ---------------------------------------------------------------------------
+""" Local stand-in of a MySQL server for benchmarks. Connections are backed by
+a sqlite file and accept the statements dbScrapper sends (DESCRIBE, %s
+parameters and multi-row ON DUPLICATE KEY UPDATE upserts). Prepared cursors
+return FLOAT columns as 4 byte floats, like the binary protocol does. Pass
+fakeDatabase(path).connect as the connect factory of a dbPool. """
+# ---------------------------------------------------------------------------
+import re
+import struct
+import sqlite3
+from time import sleep
+
+# mysql column types of the benchmark table
+benchTable = {"mal_id": "int", "title": "varchar(255)", "title_english": "varchar(255)", "synopsis": "text", "type": "varchar(16)", \
+    "episodes": "int", "status": "varchar(32)", "airing": "tinyint(1)", "score": "float", "scored_by": "int", "rank": "int", \
+    "members": "int", "favorites": "int", "aired": "text", "genres": "text"}
+
+# columns read back as 4 byte floats by prepared cursors
+floatColumns = [c for c, k in benchTable.items() if k == "float"]
+
+# cursor translating the mysql statements into sqlite ones
+class fakeCursor():
+    def __init__(self, connection, prepared=False):
+        self.connection = connection
+        self.prepared = prepared
+        self.cursor = connection.sqlite.cursor()
+        self.rows = None
+        self.description = None
+        self.rowcount = -1
+        return
+    
+    def execute(self, sql, params=()):
+        if self.connection.latency: sleep(self.connection.latency)
+        if sql.startswith("DESCRIBE"):
+            table = sql.split("`")[1]
+            self.cursor.execute(f"PRAGMA table_info(`{table}`)")
+            self.rows = [(r[1], r[2].lower(), "NO" if r[3] else "YES", "PRI" if r[5] else "", r[4], "") for r in self.cursor.fetchall()]
+            self.description = [("Field",), ("Type",), ("Null",), ("Key",), ("Default",), ("Extra",)]
+            return
+        upsert = re.search(r" ON DUPLICATE KEY UPDATE (.*)$", sql)
+        if upsert:
+            sql = sql[:upsert.start()] + " ON CONFLICT DO UPDATE SET " + re.sub(r"VALUES\((`\w+`)\)", r"excluded.\1", upsert.group(1))
+        self.cursor.execute(sql.replace("%s", "?"), tuple(params or ()))
+        self.rows = None
+        self.description = self.cursor.description
+        self.rowcount = self.cursor.rowcount
+        return
+    
+    def fetchall(self):
+        if self.rows is not None: return self.rows
+        rows = self.cursor.fetchall()
+        floats = [i for i, d in enumerate(self.description or []) if d[0] in floatColumns] if self.prepared else []
+        if not floats: return rows
+        return [tuple(struct.unpack("<f", struct.pack("<f", v))[0] if i in floats and type(v) is float else v for i, v in enumerate(r)) for r in rows]
+    
+    def close(self):
+        self.cursor.close()
+        return
+
+# connection to the sqlite file, latency in seconds is added to every statement to mimic the round trip to a server
+class fakeConnection():
+    def __init__(self, path, latency=0):
+        self.sqlite = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.latency = latency
+        return
+    
+    def cursor(self, prepared=False):
+        return fakeCursor(self, prepared)
+    
+    # statements are commited on their own like the autocommit connections of dbPool
+    def commit(self):
+        return
+    
+    def is_connected(self):
+        return True
+    
+    def reconnect(self, attempts=1, delay=0):
+        return
+    
+    def close(self):
+        self.sqlite.close()
+        return
+
+# sqlite database file with the benchmark tables
+class fakeDatabase():
+    def __init__(self, path, tables=["anime"], latency=0):
+        self.path = path
+        self.latency = latency
+        sqlite = sqlite3.connect(path)
+        for t in tables:
+            # sqlite takes the mysql type names as they are, giving the columns the matching affinity
+            cols = ",".join(f"`{c}` {k}{' PRIMARY KEY' if c == 'mal_id' else ''}" for c, k in benchTable.items())
+            sqlite.execute(f"CREATE TABLE IF NOT EXISTS `{t}` ({cols})")
+        sqlite.commit()
+        sqlite.close()
+        return
+    
+    # connection factory with the signature of mysql.connector.connect
+    def connect(self, **params):
+        return fakeConnection(self.path, self.latency)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# ---------------------------------------------------------------------------
+""" Local stand-in of the Jikan API for benchmarks. Serves anime-like entries
+at /<entity>/<id> with a configurable latency, synopsis size and density of
+missing (404) ids. Entries are generated from the seed and the id, so every run
+with the same parameters gets the same responses. """
+# ---------------------------------------------------------------------------
+import json
+import random
+import hashlib
+import argparse
+from time import sleep
+from threading import Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# fake api server, latency in seconds, payload in characters of synopsis and notFound as the fraction of missing ids
+class fakeJikan():
+    def __init__(self, latency=0, payload=2000, notFound=0.2, seed=0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.payload = payload
+        self.notFound = notFound
+        self.seed = seed
+        # bump to make every entry different from the previous responses
+        self.version = 0
+        api = self
+        class handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                api.handle(self)
+            def log_message(self, *args):
+                return
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        return
+    
+    # entry served for fetch, None if the id is missing
+    def entry(self, fetch):
+        rand = random.Random(f"{self.seed}-{fetch}")
+        if rand.random() < self.notFound: return None
+        return {
+            "mal_id": fetch,
+            "url": f"https://myanimelist.net/anime/{fetch}",
+            "title": f"Title {fetch}" + (f" v{self.version}" if self.version else ""),
+            "title_english": f"English title {fetch}",
+            "synopsis": "".join(rand.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(self.payload)),
+            "type": rand.choice(["TV", "Movie", "OVA", "ONA", "Special"]),
+            "episodes": rand.randint(1, 500),
+            "status": rand.choice(["Finished Airing", "Currently Airing", "Not yet aired"]),
+            "airing": rand.random() < 0.1,
+            "score": round(rand.uniform(1, 10), 2),
+            "scored_by": rand.randint(0, 2000000),
+            "rank": rand.randint(1, 20000),
+            "members": rand.randint(0, 3000000),
+            "favorites": rand.randint(0, 200000),
+            "aired": {"from": "2001-04-01T00:00:00+00:00", "to": None},
+            "genres": [{"mal_id": g, "type": "anime", "name": f"Genre {g}"} for g in rand.sample(range(1, 40), 3)]
+        }
+    
+    def handle(self, request):
+        if self.latency: sleep(self.latency)
+        try:
+            fetch = int(request.path.split("?")[0].rstrip("/").rsplit("/", 1)[1])
+        except ValueError:
+            request.send_error(400)
+            return
+        entry = self.entry(fetch)
+        if entry is None:
+            request.send_error(404)
+            return
+        body = json.dumps(entry).encode("utf-8")
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if request.headers.get("If-None-Match") == etag:
+            request.send_response(304)
+            request.send_header("ETag", etag)
+            request.end_headers()
+            return
+        request.send_response(200)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(body)))
+        request.send_header("ETag", etag)
+        request.end_headers()
+        request.wfile.write(body)
+        return
+    
+    # serve from a background thread
+    def start(self):
+        Thread(target=self.server.serve_forever, name="fakeJikan", daemon=True).start()
+        return self.url
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        return
+
+# serve the fake api until interrupted when run directly
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--port", help="Specify the port to listen on", type=int, default=8080)
+    parser.add_argument("-l", "--latency", help="Specify the latency of every response in milliseconds", type=float, default=0)
+    parser.add_argument("-s", "--payload", help="Specify the synopsis size of every entry in characters", type=int, default=2000)
+    parser.add_argument("-n", "--not-found", help="Specify the fraction of missing ids", type=float, default=0.2)
+    parser.add_argument("--seed", help="Specify the seed the entries are generated from", type=int, default=0)
+    args = parser.parse_args()
+    api = fakeJikan(args.latency / 1000, args.payload, args.not_found, args.seed, port=args.port)
+    print(f"Fake Jikan API serving on {api.url}")
+    try:
+        api.server.serve_forever()
+    except KeyboardInterrupt:
+        api.server.server_close()
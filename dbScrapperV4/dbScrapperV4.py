@@ -18,19 +18,1320 @@ the database depending on the comparisson result between the data. """
 # ---------------------------------------------------------------------------
 #!/usr/bin/env python3
 import json
+import sqlite3
+import hashlib
+import heapq
+import bisect
+import struct
+import os
+import gzip
+import socket
+from uuid import uuid4
+from array import array
 from types import NoneType
+from decimal import Decimal
 from mysql.connector.utils import NUMERIC_TYPES
 import requests as rq
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.request import ACCEPT_ENCODING
 import mysql.connector
-from time import sleep
+from mysql.connector.constants import ClientFlag
+import random
+import atexit
+import shutil
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from time import sleep, monotonic, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread, Event, Condition
+from queue import Queue, SimpleQueue, Empty, Full
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+# decode the api responses with the fastest json library installed
+try:
+    from orjson import loads as jsonLoads
+except ImportError:
+    try:
+        from ujson import loads as jsonLoads
+    except ImportError:
+        jsonLoads = json.loads
+# request errors retried as network errors (timeouts are retried on their own)
+networkErrors = (rq.exceptions.ConnectionError, rq.exceptions.ChunkedEncodingError, rq.exceptions.ContentDecodingError)
 
 # default database config
-defDataBaseConfig = {"api":"","database":{"host":"","port":3306,"user":"","password":"","database":""},"table":"","dbUnique":"","columns":{"API":"DB"},"delay":2}
+defDataBaseConfig = {"api":"","database":{"host":"","port":3306,"user":"","password":"","database":"","poolSize":4,"ping":30},"table":"","dbUnique":"","columns":{"API":"DB"},"delay":2,"rateLimit":{"rate":0.5,"burst":1},"http":{"timeout":[5,30],"poolSize":10},"batch":{"size":0,"interval":5},"preload":0,"fingerprints":"","verify":"full","tombstones":{"file":"","ttl":30},"refresh":{"statusColumn":"","activeValues":[1],"activeWeight":10},"cache":"","metrics":{"port":0,"file":"","interval":10},"lease":{"table":"scrapper_leases","size":1000,"ttl":300,"heartbeat":30},"retry":{"base":1,"cap":60,"budgets":{"timeout":5,"network":5,"server":8,"throttle":20},"threshold":5,"cooldown":30,"maxCooldown":300}}
+
+# create a requests session keeping up to poolSize connections alive per host
+# asks for every compression supported by the installed urllib3 (gzip, deflate and br/zstd when available)
+def httpSession(poolSize=10):
+    session = rq.Session()
+    adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    return session
+
+# queue handler passing the records to the listener thread as they are, so they are formatted and written off the logging thread
+class queueLogHandler(QueueHandler):
+    def prepare(self, record):
+        return record
+
+# log file handler rotating when the file reaches maxBytes or every interval seconds, the rotated files are compressed with gzip
+class rotatingLogHandler(RotatingFileHandler):
+    def __init__(self, file, maxBytes=10485760, backupCount=5, interval=86400):
+        super().__init__(file, maxBytes=maxBytes, backupCount=backupCount, encoding="utf-8", delay=True)
+        self.interval = interval
+        self.rolloverAt = time() + interval if interval else 0
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self.compress
+        return
+    
+    def shouldRollover(self, record):
+        if self.rolloverAt and time() >= self.rolloverAt: return True
+        return super().shouldRollover(record)
+    
+    # the next time based rollover is scheduled even if this one failed, so a single error does not fail every later record
+    def doRollover(self):
+        try:
+            super().doRollover()
+        finally:
+            if self.interval: self.rolloverAt = time() + self.interval
+        return
+    
+    # a missing (nothing logged yet) or empty log file is not kept as a backup
+    @staticmethod
+    def compress(source, dest):
+        if not os.path.exists(source): return
+        if not os.path.getsize(source):
+            os.remove(source)
+            return
+        with open(source, "rb") as sourceFile, gzip.open(dest, "wb") as destFile:
+            shutil.copyfileobj(sourceFile, destFile)
+        os.remove(source)
+        return
+
+# send the log records of the program to a rotating and compressed file through a queue, so logging never blocks on the disk
+# level is a logging level or its name, records below it are discarded before being formatted
+# returns the listener writing the file, stopped (flushing the queue) when the program exits
+def logSetup(file, level=logging.DEBUG, maxBytes=10485760, backupCount=5, interval=86400):
+    handler = rotatingLogHandler(file, maxBytes, backupCount, interval)
+    handler.setFormatter(logging.Formatter("%(asctime)s (%(levelname)s): %(message)s", '%d/%m/%Y (%a) %H:%M:%S >> '))
+    queue = SimpleQueue()
+    listener = QueueListener(queue, handler)
+    root = logging.getLogger()
+    root.addHandler(queueLogHandler(queue))
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+# converters of api values into the values their database column type holds, compiled per mapped column by dbScrapper
+# values not fitting the column type fall back to convertValue, the generic normalization
+def convertValue(value):
+    if not type(value) in NUMERIC_TYPES:
+        if type(value) is bool:
+            return int(value)
+        elif not type(value) in [NoneType, str]:
+            return str(value)
+        return value
+    return value if type(value) is int else float(value)
+
+def convertInt(value):
+    if type(value) in [int, bool]:
+        return int(value)
+    if type(value) is float and value.is_integer():
+        return int(value)
+    if type(value) is str:
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    return convertValue(value)
+
+def convertFloat(value):
+    if type(value) in [int, bool, float, Decimal]:
+        return float(value)
+    if type(value) is str:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return convertValue(value)
+
+# float columns hold 4 byte floats, read back by prepared statements with the float32 error (7.93 as 7.929999828338623)
+# values are rounded to float32 and kept to its 7 significant digits, so the api value and the value read back compare equal
+def convertFloat32(value):
+    value = convertFloat(value)
+    if type(value) is not float: return value
+    try:
+        return float(f"{struct.unpack('<f', struct.pack('<f', value))[0]:.7g}")
+    except OverflowError:
+        return value
+
+# text as mysql stores it, so it compares equal to the value read back
+def convertText(value):
+    if type(value) in [NoneType, str]:
+        return value
+    if type(value) is bool:
+        return str(int(value))
+    return str(value)
+
+# json with sorted keys, mysql does not keep the order of the keys
+def convertJson(value):
+    if type(value) in [dict, list]:
+        return json.dumps(value, sort_keys=True)
+    return convertText(value)
+
+# iso 8601 dates and datetimes, aware ones in utc
+def convertDatetime(value, date=False):
+    if type(value) is str:
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+        if parsed.tzinfo:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return str(parsed.date()) if date else str(parsed)
+    return convertValue(value)
+
+def convertDate(value):
+    return convertDatetime(value, True)
+
+# (database column type) : converter
+columnConverters = {"tinyint": convertInt, "smallint": convertInt, "mediumint": convertInt, "int": convertInt, "integer": convertInt, "bigint": convertInt, "year": convertInt, \
+    "float": convertFloat32, "double": convertFloat, "real": convertFloat, "decimal": convertFloat, "numeric": convertFloat, \
+    "char": convertText, "varchar": convertText, "tinytext": convertText, "text": convertText, "mediumtext": convertText, "longtext": convertText, "enum": convertText, "set": convertText, \
+    "json": convertJson, "date": convertDate, "datetime": convertDatetime, "timestamp": convertDatetime}
+
+# base type of a DESCRIBE column type (like 'int(11) unsigned' or b'varchar(255)')
+def columnBaseType(columnType):
+    if type(columnType) in [bytes, bytearray]: columnType = columnType.decode()
+    return str(columnType).split("(")[0].split(" ")[0].lower()
+
+# converter of a column from its DESCRIBE type
+def columnConverter(columnType):
+    return columnConverters.get(columnBaseType(columnType), convertValue)
+
+# converters of the values read from a database column into the values the api converters give for it
+def rowText(value):
+    return value.decode("utf-8") if type(value) in [bytes, bytearray] else value
+
+def rowJson(value):
+    try:
+        return json.dumps(json.loads(rowText(value)), sort_keys=True)
+    except ValueError:
+        return rowText(value)
+
+# (database column type) : converter of its values, None when they are compared as they are read
+rowConverters = {"tinyint": None, "smallint": None, "mediumint": None, "int": None, "integer": None, "bigint": None, "year": None, \
+    "float": convertFloat32, "double": None, "real": None, "decimal": float, "numeric": float, \
+    "char": rowText, "varchar": rowText, "tinytext": rowText, "text": rowText, "mediumtext": rowText, "longtext": rowText, "enum": rowText, "set": rowText, \
+    "json": rowJson, "date": str, "datetime": str, "timestamp": str}
+
+def rowConverter(columnType):
+    return rowConverters.get(columnBaseType(columnType), convertValue)
+
+# token bucket pacing the requests made to an api, safe to share between threads
+# the rate shrinks when the api answers with errors and grows back to the configured rate with every success
+class rateLimiter():
+    def __init__(self, rate, burst=1, minRate=False):
+        # configured requests per second and the current adapted rate
+        self.maxRate = float(rate)
+        self.rate = self.maxRate
+        self.minRate = minRate if minRate else self.maxRate/16
+        # max requests allowed to go out back to back
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.stamp = monotonic()
+        # no request goes out before this time (set by 429 responses)
+        self.pausedUntil = 0
+        self.lock = Lock()
+        return
+    
+    # block until a request is allowed to be sent
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+                if now >= self.pausedUntil:
+                    self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                    self.stamp = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.pausedUntil - now
+            sleep(wait)
+    
+    # adapt the rate to the status code of a response
+    # retryAfter is the value of the 'Retry-After' header (seconds or http date) if the response had it
+    def feedback(self, status, retryAfter=None):
+        with self.lock:
+            if status == 429:
+                self.rate = max(self.minRate, self.rate / 2)
+                pause = self.retryDelay(retryAfter)
+                self.pausedUntil = max(self.pausedUntil, monotonic() + (pause if pause else 1 / self.rate))
+                self.tokens = 0
+                self.stamp = self.pausedUntil
+            elif status >= 500:
+                self.rate = max(self.minRate, self.rate * 0.75)
+            else:
+                self.rate = min(self.maxRate, self.rate + self.maxRate / 20)
+        return
+    
+    # parse a 'Retry-After' header value into seconds
+    @staticmethod
+    def retryDelay(retryAfter):
+        if not retryAfter: return False
+        try:
+            return max(0, float(retryAfter))
+        except ValueError:
+            pass
+        try:
+            return max(0, (parsedate_to_datetime(retryAfter) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return False
+
+
+# retry policy of the requests made to an api, safe to share between threads and dbScrapper objects
+# failed ids are requested again after a jittered exponential backoff, until the retry budget of their error class is spent
+# a circuit breaker pauses every request once threshold requests in a row failed, and lets a single probe through after cooldown seconds
+class retryPolicy():
+    # error class of the retryable status codes, network errors and timeouts are classes of their own
+    statusClasses = {429: "throttle", 500: "server", 502: "server", 503: "server", 504: "server"}
+    
+    def __init__(self, base=1, cap=60, budgets=False, threshold=5, cooldown=30, maxCooldown=300):
+        # backoff of the n-th retry of an id is a random delay between 0 and min(cap, base * 2^(n-1)) seconds
+        self.base = base
+        self.cap = cap
+        # max retries of an id per error class
+        self.budgets = {"timeout": 5, "network": 5, "server": 8, "throttle": 20}
+        if budgets: self.budgets.update(budgets)
+        # {id: {error class: failures}} of the ids being retried
+        self.attempts = {}
+        # circuit breaker state ("closed", "open" or "halfOpen"), failures in a row and current cooldown, doubled every failed probe
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.maxCooldown = max(cooldown, maxCooldown)
+        self.state = "closed"
+        self.failures = 0
+        self.openFor = cooldown
+        self.openUntil = 0
+        self.probeStamp = 0
+        self.condition = Condition()
+        return
+    
+    # block while the circuit is open, after its cooldown only one request (the probe) goes out until its result is recorded
+    def wait(self):
+        with self.condition:
+            while True:
+                now = monotonic()
+                if self.state == "closed":
+                    return
+                if self.state == "open" and now >= self.openUntil:
+                    self.state = "halfOpen"
+                    self.probeStamp = 0
+                # a probe whose result never came is replaced after a cooldown
+                if self.state == "halfOpen" and now - self.probeStamp >= self.cooldown:
+                    self.probeStamp = now
+                    return
+                self.condition.wait(max(0.01, self.openUntil - now) if self.state == "open" else 1)
+    
+    # record the result of a request in the circuit breaker, ok is False for network errors, timeouts and 5xx responses
+    def record(self, ok):
+        with self.condition:
+            if ok:
+                if self.state != "closed":
+                    print("API is available again! Resuming requests...")
+                self.state = "closed"
+                self.failures = 0
+                self.openFor = self.cooldown
+            else:
+                self.failures += 1
+                if self.state == "halfOpen" or (self.state == "closed" and self.failures >= self.threshold):
+                    if self.state == "halfOpen": self.openFor = min(self.maxCooldown, self.openFor * 2)
+                    self.state = "open"
+                    self.openUntil = monotonic() + self.openFor
+                    print(f"API is not available! Pausing every request for {self.openFor}s...")
+            self.condition.notify_all()
+        return
+    
+    # count a retryable failure of fetch in its error class
+    def failure(self, fetch, errorClass):
+        with self.condition:
+            counts = self.attempts.setdefault(fetch, {})
+            counts[errorClass] = counts.get(errorClass, 0) + 1
+        return
+    
+    # forget the failures of fetch once it got an answer
+    def success(self, fetch):
+        with self.condition:
+            self.attempts.pop(fetch, None)
+        return
+    
+    # sleep the backoff delay before fetch is requested again
+    # returns False without sleeping (and forgets its failures) if the retry budget of one of its error classes is spent
+    def backoff(self, fetch):
+        with self.condition:
+            counts = self.attempts.get(fetch, {})
+            if any(n > self.budgets.get(c, 5) for c, n in counts.items()):
+                del self.attempts[fetch]
+                return False
+            retries = sum(counts.values())
+        if retries: sleep(random.uniform(0, min(self.cap, self.base * 2 ** (retries - 1))))
+        return True
+
+
+# pool of database connections safe to share between threads
+# connections are opened when needed (up to size), checked out for every call and health checked when idle for ping seconds
+class dbPool():
+    def __init__(self, database, connect=False):
+        self.params = {
+            "host": database["host"],
+            "port": database["port"],
+            "user": database["user"],
+            "password": database["password"],
+            "database": database["database"],
+            # every statement is commited on its own, so reads on any connection see the latest writes
+            "autocommit": True,
+            # report matched rows (not only changed ones) as the rowcount of updates
+            "client_flags": [ClientFlag.FOUND_ROWS]
+        }
+        self.size = database.get("poolSize", 4)
+        self.ping = database.get("ping", 30)
+        # connection factory, mysql.connector.connect unless a stand-in is given
+        self.connect = connect if connect else mysql.connector.connect
+        self.idle = Queue()
+        self.opened = 0
+        self.lock = Lock()
+        # last use time and prepared cursors of every connection: {id(connection): [time, {sql: (sql, cursor)}]}
+        self.state = {}
+        # open the first connection right away to fail early
+        self.idle.put(self.newConnection())
+        return
+    
+    # open a new connection (dropped connections are recovered by connection and execute)
+    def newConnection(self):
+        try:
+            cnx = self.connect(**self.params)
+        except mysql.connector.Error:
+            print("Couldn't connect to database!")
+            raise
+        with self.lock:
+            self.opened += 1
+            self.state[id(cnx)] = [monotonic(), {}]
+        return cnx
+    
+    # close a connection that could not be recovered and forget it, so a new one can be opened in its place
+    def discard(self, cnx):
+        try:
+            cnx.close()
+        except Exception:
+            pass
+        with self.lock:
+            self.opened -= 1
+            self.state.pop(id(cnx), None)
+        return
+    
+    # get an idle connection, opening a new one while below size
+    # waits for a connection to be returned otherwise, checking again every second in case one was discarded
+    def checkout(self):
+        while True:
+            try:
+                return self.idle.get_nowait()
+            except Empty:
+                pass
+            with self.lock:
+                grow = self.opened < self.size
+            if grow:
+                return self.newConnection()
+            try:
+                return self.idle.get(timeout=1)
+            except Empty:
+                pass
+    
+    # check out a connection for the duration of a with block
+    @contextmanager
+    def connection(self):
+        cnx = self.checkout()
+        state = self.state[id(cnx)]
+        # health check connections idle for a while, reconnecting the dropped ones
+        try:
+            if monotonic() - state[0] >= self.ping and not cnx.is_connected():
+                print("Database connection lost! Reconnecting...")
+                cnx.reconnect(attempts=3, delay=5)
+                state[1] = {}
+        except Exception:
+            self.discard(cnx)
+            raise
+        try:
+            yield cnx
+            state[0] = monotonic()
+        except (mysql.connector.OperationalError, mysql.connector.InterfaceError):
+            # reconnect the connection before it goes back to the pool, discarding it if the server can't be reached
+            try:
+                cnx.reconnect(attempts=3, delay=5)
+                state[0] = monotonic()
+                state[1] = {}
+            except Exception:
+                self.discard(cnx)
+                cnx = None
+            raise
+        finally:
+            if cnx is not None: self.idle.put(cnx)
+    
+    # execute sql with params on a checked out connection
+    # a statement failing because the connection dropped is executed once more on a reconnected (or new) connection
+    # returns the fetched rows (empty if the statement has no results) and the rowcount
+    def execute(self, sql, params=(), prepared=True):
+        try:
+            return self.statement(sql, params, prepared)
+        except (mysql.connector.OperationalError, mysql.connector.InterfaceError):
+            print("Database connection lost! Executing the statement again...")
+            return self.statement(sql, params, prepared)
+    
+    # execute sql with params once, prepared statements are kept per connection, preparing them the first time sql is used
+    def statement(self, sql, params=(), prepared=True):
+        with self.connection() as cnx:
+            if prepared:
+                statements = self.state[id(cnx)][1]
+                if sql not in statements:
+                    statements[sql] = (sql, cnx.cursor(prepared=True))
+                # the cursor only keeps the statement prepared if it gets the same sql object again
+                sql, cursor = statements[sql]
+            else:
+                cursor = cnx.cursor()
+            cursor.execute(sql, params)
+            rows = cursor.fetchall() if cursor.description else []
+            count = cursor.rowcount
+            if not prepared: cursor.close()
+        return rows, count
+    
+    # close every idle connection
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except Empty:
+                break
+        return
+
+# ranges of ids of a table leased to the workers scrapping it, kept in a table of the database so any number of processes or machines share a pass
+# a lease expires ttl seconds after its last heartbeat (database server time), so the range of a crashed worker is claimed again from its last reported progress
+class leaseTable():
+    def __init__(self, pool, entity, table="scrapper_leases", size=1000, ttl=300, heartbeat=30, owner=False):
+        self.pool = pool
+        self.entity = entity
+        self.table = table
+        self.size = size
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        # unique name of this worker
+        self.owner = owner if owner else f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        # currently leased range [start, end) and the first id of it not completed yet
+        self.start, self.end, self.next = False, False, False
+        self.stamp = monotonic()
+        self.pool.execute(f"CREATE TABLE IF NOT EXISTS `{table}` (`entity` VARCHAR(64) NOT NULL, `start` INT NOT NULL, `end` INT NOT NULL, `next` INT NOT NULL, " + \
+            "`owner` VARCHAR(128) NULL, `expires` BIGINT NOT NULL DEFAULT 0, `done` TINYINT NOT NULL DEFAULT 0, PRIMARY KEY (`entity`, `start`))", prepared=False)
+        self.sqlFree = f"SELECT `start`, `end`, `next` FROM `{table}` WHERE `entity`=%s AND `done`=0 AND (`owner` IS NULL OR `expires`<UNIX_TIMESTAMP()) ORDER BY `start` LIMIT 8"
+        self.sqlClaim = f"UPDATE `{table}` SET `owner`=%s, `expires`=UNIX_TIMESTAMP()+%s WHERE `entity`=%s AND `start`=%s AND `done`=0 AND (`owner` IS NULL OR `expires`<UNIX_TIMESTAMP())"
+        self.sqlBeat = f"UPDATE `{table}` SET `expires`=UNIX_TIMESTAMP()+%s, `next`=%s WHERE `entity`=%s AND `start`=%s AND `owner`=%s AND `done`=0"
+        self.sqlComplete = f"UPDATE `{table}` SET `done`=1, `owner`=NULL, `expires`=0, `next`=`end` WHERE `entity`=%s AND `start`=%s AND `owner`=%s"
+        self.sqlRelease = f"UPDATE `{table}` SET `owner`=NULL, `expires`=0, `next`=%s WHERE `entity`=%s AND `start`=%s AND `owner`=%s"
+        return
+    
+    # add the ranges needed to cover the ids below maxId, ranges are aligned to size so every worker adds the same ones
+    def plan(self, maxId):
+        rows, _ = self.pool.execute(f"SELECT MAX(`end`) FROM `{self.table}` WHERE `entity`=%s", (self.entity,))
+        start = rows[0][0] if rows and rows[0][0] is not None else 0
+        ranges = [(self.entity, s, s + self.size, s) for s in range(start, maxId, self.size)]
+        for i in range(0, len(ranges), 500):
+            chunk = ranges[i:i + 500]
+            self.pool.execute(f"INSERT IGNORE INTO `{self.table}` (`entity`, `start`, `end`, `next`) VALUES " + ",".join(["(%s,%s,%s,%s)"] * len(chunk)), \
+                [v for r in chunk for v in r], False)
+        return len(ranges)
+    
+    # number of ranges not completed yet
+    def remaining(self):
+        rows, _ = self.pool.execute(f"SELECT COUNT(*) FROM `{self.table}` WHERE `entity`=%s AND `done`=0", (self.entity,))
+        return rows[0][0]
+    
+    # start a new pass when every range of the last one was completed
+    # returns True if a new pass was started
+    def reset(self):
+        if self.remaining(): return False
+        _, count = self.pool.execute(f"UPDATE `{self.table}` SET `done`=0, `next`=`start`, `owner`=NULL, `expires`=0 WHERE `entity`=%s AND `done`=1", (self.entity,))
+        return count > 0
+    
+    # claim a free or expired range, picking one of the first free ones at random so concurrent workers rarely collide
+    # returns True if a range was leased (see start, end and next)
+    def claim(self):
+        while True:
+            free, _ = self.pool.execute(self.sqlFree, (self.entity,))
+            if not free: return False
+            start, end, progress = random.choice(free)
+            _, count = self.pool.execute(self.sqlClaim, (self.owner, self.ttl, self.entity, start))
+            if count == 1:
+                self.start, self.end, self.next = start, end, progress
+                self.stamp = monotonic()
+                return True
+    
+    # renew the lease every heartbeat seconds, reporting progress as the first id not completed yet (if given)
+    # returns False if the lease expired and was claimed by another worker
+    def beat(self, progress=None):
+        if progress is not None: self.next = progress
+        if monotonic() - self.stamp < self.heartbeat: return True
+        _, count = self.pool.execute(self.sqlBeat, (self.ttl, self.next, self.entity, self.start, self.owner))
+        self.stamp = monotonic()
+        if count != 1:
+            print(f"Lease of {self.entity} Ids {self.start} to {self.end - 1} was lost!")
+            return False
+        return True
+    
+    # mark the leased range as completed
+    def complete(self):
+        _, count = self.pool.execute(self.sqlComplete, (self.entity, self.start, self.owner))
+        self.start, self.end, self.next = False, False, False
+        return count == 1
+    
+    # give the leased range back, keeping its progress
+    def release(self):
+        if self.start is False: return
+        self.pool.execute(self.sqlRelease, (self.next, self.entity, self.start, self.owner))
+        self.start, self.end, self.next = False, False, False
+        return
+
+# local sqlite store mapping every uniqueId to the hash of its last known normalized row
+# also keeps when every entry was last fetched, how many times it was checked and changed, if it is still active (airing/publishing)
+# and the http validators (ETag and Last-Modified) of the response it was stored from
+class fingerprintStore():
+    columns = {"fetched": "REAL NOT NULL DEFAULT 0", "checks": "INTEGER NOT NULL DEFAULT 0", "changes": "INTEGER NOT NULL DEFAULT 0", "active": "INTEGER NOT NULL DEFAULT 0", \
+        "etag": "TEXT", "modified": "TEXT"}
+    
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS fingerprints (id PRIMARY KEY, hash TEXT NOT NULL)")
+        # add the refresh columns to stores created before them
+        existing = [c[1] for c in self.db.execute("PRAGMA table_info(fingerprints)").fetchall()]
+        for c in self.columns:
+            if c not in existing: self.db.execute(f"ALTER TABLE fingerprints ADD COLUMN {c} {self.columns[c]}")
+        self.db.commit()
+        self.lock = Lock()
+        # writes not commited yet
+        self.pending = 0
+        return
+    
+    # returns the stored hash of fetch, or None if it is not in the store
+    def get(self, fetch):
+        with self.lock:
+            row = self.db.execute("SELECT hash FROM fingerprints WHERE id=?", (fetch,)).fetchone()
+        return row[0] if row else None
+    
+    # returns the stored (etag, modified) validators of fetch, or None if it is not in the store
+    def validators(self, fetch):
+        with self.lock:
+            return self.db.execute("SELECT etag, modified FROM fingerprints WHERE id=?", (fetch,)).fetchone()
+    
+    # store the hash and validators of fetch and count a check of it (a change if changed is True)
+    def set(self, fetch, digest, changed=False, active=False, etag=None, modified=None):
+        self.write("INSERT INTO fingerprints (id, hash, fetched, checks, changes, active, etag, modified) VALUES (?,?,?,1,?,?,?,?) " \
+            "ON CONFLICT(id) DO UPDATE SET hash=excluded.hash, fetched=excluded.fetched, checks=checks+1, changes=changes+excluded.changes, " \
+            "active=excluded.active, etag=excluded.etag, modified=excluded.modified", (fetch, digest, time(), int(changed), int(active), etag, modified))
+        return
+    
+    # store only the hash of fetch, keeping its validators and refresh stats
+    def setHash(self, fetch, digest):
+        self.write("INSERT INTO fingerprints (id, hash) VALUES (?,?) ON CONFLICT(id) DO UPDATE SET hash=excluded.hash", (fetch, digest))
+        return
+    
+    # count an unchanged check of fetch without touching its hash
+    def touch(self, fetch):
+        self.write("UPDATE fingerprints SET fetched=?, checks=checks+1 WHERE id=?", (time(), fetch))
+        return
+    
+    # execute a write, commiting every 100 writes
+    def write(self, sql, params):
+        with self.lock:
+            self.db.execute(sql, params)
+            self.pending += 1
+            if self.pending >= 100:
+                self.db.commit()
+                self.pending = 0
+        return
+    
+    # replace the hashes of the store with the (id, hash) pairs of entries, keeping the refresh stats of the ids still in entries
+    # validators are cleared since they no longer describe the rows the hashes come from
+    def rebuild(self, entries):
+        with self.lock:
+            self.db.execute("CREATE TEMP TABLE rebuild (id PRIMARY KEY, hash TEXT NOT NULL)")
+            self.db.executemany("INSERT OR REPLACE INTO rebuild VALUES (?,?)", entries)
+            self.db.execute("DELETE FROM fingerprints WHERE id NOT IN (SELECT id FROM rebuild)")
+            self.db.execute("INSERT INTO fingerprints (id, hash) SELECT id, hash FROM rebuild WHERE true ON CONFLICT(id) DO UPDATE SET hash=excluded.hash, etag=NULL, modified=NULL")
+            self.db.execute("DROP TABLE rebuild")
+            self.db.commit()
+            self.pending = 0
+            count = self.db.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+        return count
+    
+    # returns (id, fetched, checks, changes, active) for every entry in the store
+    def stats(self):
+        with self.lock:
+            return self.db.execute("SELECT id, fetched, checks, changes, active FROM fingerprints").fetchall()
+    
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+        return
+
+# compact on-disk set of ids the api reported as not found, each one expiring after ttl days
+# the file is an append-only list of (id, unix time) records, a time of 0 removes the id
+class tombstoneSet():
+    record = struct.Struct("<II")
+    
+    def __init__(self, path, ttl=30):
+        self.path = path
+        self.ttl = ttl * 86400
+        # time of the last 404 of every id, indexed by id (0 when the id is not in the set)
+        self.marks = array("I")
+        self.lock = Lock()
+        records = 0
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                content = file.read()
+            for fetch, stamp in self.record.iter_unpack(content[:len(content) - len(content) % self.record.size]):
+                self.mark(fetch, stamp)
+                records += 1
+        # rewrite the file without the removed or repeated ids when it grew too much
+        live = sum(1 for m in self.marks if m)
+        if records > 2 * live + 1000:
+            self.compact()
+        self.file = open(path, "ab")
+        self.pending = 0
+        return
+    
+    def mark(self, fetch, stamp):
+        if fetch >= len(self.marks):
+            self.marks.extend([0] * (fetch + 1 - len(self.marks)))
+        self.marks[fetch] = stamp
+        return
+    
+    def compact(self):
+        with open(self.path + ".tmp", "wb") as file:
+            for fetch, stamp in enumerate(self.marks):
+                if stamp: file.write(self.record.pack(fetch, stamp))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        return
+    
+    # returns True if fetch got a 404 less than ttl days ago
+    def has(self, fetch):
+        if type(fetch) is not int or fetch < 0 or fetch >= len(self.marks) or not self.marks[fetch]: return False
+        return time() - self.marks[fetch] < self.ttl
+    
+    # add (stamp > 0) or remove (stamp 0) fetch, writing the change to the file
+    def set(self, fetch, stamp):
+        if type(fetch) is not int or fetch < 0: return
+        with self.lock:
+            if not stamp and (fetch >= len(self.marks) or not self.marks[fetch]): return
+            self.mark(fetch, stamp)
+            self.file.write(self.record.pack(fetch, stamp))
+            self.pending += 1
+            if self.pending >= 100:
+                self.file.flush()
+                self.pending = 0
+        return
+    
+    def add(self, fetch):
+        self.set(fetch, int(time()))
+        return
+    
+    def discard(self, fetch):
+        self.set(fetch, 0)
+        return
+    
+    def close(self):
+        with self.lock:
+            self.file.close()
+        return
+
+# on-disk cache of raw api responses, one gzip file per url named after the sha256 of the url
+# a file holds a json line with the url, status code and validator headers followed by the raw response body
+class responseCache():
+    headers = ["Content-Type", "ETag", "Last-Modified"]
+    
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        return
+    
+    def file(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, key[:2], key + ".gz")
+    
+    # returns the cached response of url as a requests Response, or None if it is not cached
+    def read(self, url):
+        try:
+            with open(self.file(url), "rb") as file:
+                meta, body = gzip.decompress(file.read()).split(b"\n", 1)
+        except FileNotFoundError:
+            return None
+        meta = json.loads(meta)
+        response = rq.models.Response()
+        response.url = meta["url"]
+        response.status_code = meta["status"]
+        response.headers = CaseInsensitiveDict(meta["headers"])
+        response.encoding = "utf-8"
+        response._content = body
+        return response
+    
+    def write(self, url, response):
+        meta = {"url": url, "status": response.status_code, "headers": {h: response.headers[h] for h in self.headers if h in response.headers}}
+        path = self.file(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so a crash never leaves a truncated entry
+        with open(path + ".tmp", "wb") as file:
+            file.write(gzip.compress(json.dumps(meta).encode("utf-8") + b"\n" + response.content, 6))
+        os.replace(path + ".tmp", path)
+        return
+
+# crash-safe record of the completed ids of a crawl, kept as merged [first, last] ranges so ids can complete in any order
+# the file is an append-only list of json lines ({"range":[a,b]}, {"maxId":n} or {"finished":true}) synced in batches and compacted when it grows
+class checkpointJournal():
+    def __init__(self, path, syncEvery=100, syncInterval=5):
+        self.path = path
+        self.syncEvery = syncEvery
+        self.syncInterval = syncInterval
+        # merged completed ranges (durable or not) and the completed ids not synced to the file yet
+        self.ranges = []
+        self.pending = []
+        self.maxId = False
+        self.finished = False
+        self.lines = 0
+        self.lock = Lock()
+        partial = False
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                for line in file:
+                    try:
+                        self.apply(json.loads(line))
+                        self.lines += 1
+                    except ValueError:
+                        # a crash in the middle of a write leaves a partial last line
+                        partial = True
+        if partial or self.lines > 2 * len(self.ranges) + 100: self.compact()
+        self.file = open(path, "a")
+        self.stamp = monotonic()
+        return
+    
+    def apply(self, record):
+        if "range" in record: self.merge(*record["range"])
+        if "maxId" in record: self.maxId = record["maxId"]
+        if "finished" in record: self.finished = record["finished"]
+        return
+    
+    # add the [first, last] range to self.ranges, merging it with the ranges it touches
+    def merge(self, first, last):
+        i = bisect.bisect_left(self.ranges, [first, first])
+        if i > 0 and self.ranges[i - 1][1] >= first - 1: i -= 1
+        j = i
+        while j < len(self.ranges) and self.ranges[j][0] <= last + 1:
+            first, last = min(first, self.ranges[j][0]), max(last, self.ranges[j][1])
+            j += 1
+        self.ranges[i:j] = [[first, last]]
+        return
+    
+    # returns the completed [first, last] range holding fetch, or None if fetch was not completed
+    def doneRange(self, fetch):
+        i = bisect.bisect_right(self.ranges, [fetch, float("inf")])
+        return self.ranges[i - 1] if i > 0 and self.ranges[i - 1][1] >= fetch else None
+    
+    # number of completed ids
+    def count(self):
+        return sum(last - first + 1 for first, last in self.ranges)
+    
+    # yields the ids from start to end (not included) that are not completed yet
+    def todo(self, start, end):
+        fetch = start
+        while fetch < end:
+            completed = self.doneRange(fetch)
+            if completed:
+                fetch = completed[1] + 1
+                continue
+            yield fetch
+            fetch += 1
+        return
+    
+    # mark fetch as completed, it becomes durable with the next sync
+    def done(self, fetch):
+        with self.lock:
+            self.merge(fetch, fetch)
+            self.pending.append(fetch)
+        return
+    
+    # append the pending ids to the file as ranges and fsync it, once syncEvery ids or syncInterval seconds are reached (or always if force)
+    def sync(self, force=False):
+        with self.lock:
+            if not self.pending or not (force or len(self.pending) >= self.syncEvery or monotonic() - self.stamp >= self.syncInterval): return
+            self.pending.sort()
+            records = []
+            first = last = self.pending[0]
+            for fetch in self.pending[1:]:
+                if fetch > last + 1:
+                    records.append({"range": [first, last]})
+                    first = fetch
+                last = fetch
+            records.append({"range": [first, last]})
+            self.pending = []
+            self.write(records)
+        return
+    
+    def write(self, records):
+        self.file.write("".join(json.dumps(r) + "\n" for r in records))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.lines += len(records)
+        self.stamp = monotonic()
+        if self.lines > 2 * len(self.ranges) + 100:
+            self.file.close()
+            self.compact()
+            self.file = open(self.path, "a")
+        return
+    
+    # rewrite the file with only the merged ranges and status
+    def compact(self):
+        records = [{"range": r} for r in self.ranges]
+        if self.maxId: records.append({"maxId": self.maxId})
+        if self.finished: records.append({"finished": True})
+        with open(self.path + ".tmp", "w") as file:
+            file.write("".join(json.dumps(r) + "\n" for r in records))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        self.lines = len(records)
+        return
+    
+    def setMax(self, maxId):
+        with self.lock:
+            self.maxId = maxId
+            self.write([{"maxId": maxId}])
+        return
+    
+    # sync every pending id and mark the crawl as finished
+    def finish(self):
+        self.sync(True)
+        with self.lock:
+            self.finished = True
+            self.write([{"finished": True}])
+        return
+    
+    # forget every completed id to start a new crawl
+    def reset(self):
+        with self.lock:
+            self.ranges, self.pending = [], []
+            self.maxId, self.finished = False, False
+            self.compact()
+            self.file.close()
+            self.file = open(self.path, "a")
+        return
+    
+    def close(self):
+        self.sync(True)
+        self.file.close()
+        return
+
+# paho mqtt client reconnecting on its own (paho is only needed by the mqtt scripts)
+def mqttClient():
+    from paho.mqtt import client as mqtt
+    try:
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    except AttributeError:
+        client = mqtt.Client()
+    # paho keeps reconnecting on its own network thread and resends the unacknowledged messages
+    client.reconnect_delay_set(1, 60)
+    return client
+
+# long lived mqtt client publishing status messages from a background thread, the caller never waits on the broker
+# messages published with a key are coalesced, only the latest one per key is sent every interval seconds along with how many arrived
+class mqttPublisher():
+    def __init__(self, brokerUrl, topic, interval=10, qos=2, retain=True, port=1883, maxQueue=1000):
+        self.topic = topic
+        self.interval = interval
+        self.qos = qos
+        self.retain = retain
+        self.client = mqttClient()
+        self.client.connect_async(brokerUrl, port)
+        self.client.loop_start()
+        self.queue = Queue(maxQueue)
+        # latest coalesced message and its count per key
+        self.pending = {}
+        self.stamp = monotonic()
+        self.last = None
+        self.lock = Lock()
+        self.thread = Thread(target=self.run, name="mqttPublisher", daemon=True)
+        self.thread.start()
+        return
+    
+    # queue a message to be published, coalescing it with the previous ones of the same key if given
+    def publish(self, message, key=None):
+        message = str(datetime.now())+">>"+str(message)
+        if key is not None:
+            with self.lock:
+                count = self.pending[key][1] if key in self.pending else 0
+                self.pending[key] = (message, count + 1)
+            return
+        try:
+            self.queue.put_nowait(message)
+        except Full:
+            print("MQTT status queue is full, message dropped!")
+        return
+    
+    # send the queued messages as they arrive and the coalesced ones every interval seconds
+    def run(self):
+        while True:
+            try:
+                message = self.queue.get(timeout=max(0, self.stamp + self.interval - monotonic()))
+            except Empty:
+                message = False
+            if message is None:
+                break
+            if message:
+                self.send(message)
+            if monotonic() >= self.stamp + self.interval:
+                self.summary()
+        self.summary()
+        return
+    
+    def summary(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        elapsed = monotonic() - self.stamp
+        self.stamp = monotonic()
+        for message, count in pending.values():
+            self.send(message if count == 1 else f"{message} ({count} updates in {elapsed:.0f}s)")
+        return
+    
+    def send(self, message):
+        try:
+            self.last = self.client.publish(self.topic, message, self.qos, self.retain)
+        except Exception as e:
+            print(f"Couldn't update mqtt status! ({e})")
+        return
+    
+    # publish everything still queued and wait up to timeout seconds for the broker to acknowledge it
+    def close(self, timeout=5):
+        self.queue.put(None)
+        self.thread.join(timeout)
+        try:
+            if self.last: self.last.wait_for_publish(timeout)
+        except Exception:
+            pass
+        self.client.disconnect()
+        self.client.loop_stop()
+        return
+
+# work queue of id ranges over mqtt, a coordinator hands out the ranges of a pass to any number of workers connected to the same broker
+# idle workers ask for a range on the requests topic and get it on their own items topic, then report their progress and completion on the acks topic
+# a range not reported within timeout seconds is handed out again from its last reported progress, so the range of a lost worker is not lost
+class mqttWorkQueue():
+    def __init__(self, brokerUrl, topic, port=1883, timeout=300, heartbeat=30):
+        self.requestsTopic = f"{topic}/requests"
+        self.itemsTopic = f"{topic}/items"
+        self.acksTopic = f"{topic}/acks"
+        self.controlTopic = f"{topic}/control"
+        self.timeout = timeout
+        self.heartbeat = heartbeat
+        # unique name of this worker
+        self.worker = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self.subscriptions = []
+        self.messages = Queue()
+        self.connected = Event()
+        self.stamp = 0
+        self.last = None
+        self.client = mqttClient()
+        self.client.on_connect = self.onConnect
+        self.client.on_message = self.onMessage
+        self.client.connect_async(brokerUrl, port)
+        self.client.loop_start()
+        return
+    
+    # (re)subscribe to every topic once connected
+    def onConnect(self, client, userdata, flags, *args):
+        for t in self.subscriptions:
+            client.subscribe(t, 1)
+        self.connected.set()
+        return
+    
+    def onMessage(self, client, userdata, message):
+        try:
+            self.messages.put((message.topic, json.loads(message.payload)))
+        except ValueError:
+            print(f"Invalid work queue message on {message.topic}!")
+        return
+    
+    def subscribe(self, topic):
+        self.subscriptions.append(topic)
+        if self.connected.is_set(): self.client.subscribe(topic, 1)
+        return
+    
+    def send(self, topic, message):
+        self.last = self.client.publish(topic, json.dumps(message), 1)
+        return
+    
+    # consecutive ids grouped into (start, end, first id to scrap) ranges of up to size ids
+    @staticmethod
+    def ranges(ids, size):
+        start = end = None
+        for x in ids:
+            if start is not None and x == end and end - start < size:
+                end += 1
+                continue
+            if start is not None: yield (start, end, start)
+            start, end = x, x + 1
+        if start is not None: yield (start, end, start)
+        return
+    
+    # hand out the ranges of up to size ids not completed in journal below maxId until every one of them is completed
+    # the progress reported by the workers is marked in journal, which is finished at the end
+    def coordinate(self, journal, maxId, size=1000):
+        self.subscribe(self.requestsTopic)
+        self.subscribe(self.acksTopic)
+        self.connected.wait()
+        pending = deque(self.ranges(journal.todo(0, maxId), size))
+        # {start: [end, progress, deadline]} of the ranges handed out and the workers waiting for one
+        outstanding = {}
+        waiting = deque()
+        print(f"Coordinating {len(pending)} ranges up to Id: {maxId}")
+        while pending or outstanding:
+            try:
+                topic, message = self.messages.get(timeout=1)
+            except Empty:
+                topic, message = None, {}
+            if topic == self.requestsTopic and message.get("worker") and message["worker"] not in waiting:
+                waiting.append(message["worker"])
+            elif topic == self.acksTopic and message.get("start") in outstanding:
+                item = outstanding[message["start"]]
+                progress = item[0] if message.get("state") == "done" else min(item[0], message.get("from", item[1]))
+                for x in range(item[1], progress):
+                    journal.done(x)
+                item[1] = max(item[1], progress)
+                item[2] = monotonic() + self.timeout
+                if message.get("state") == "done":
+                    del outstanding[message["start"]]
+                journal.sync()
+            # ranges not reported in time go back to the front of the queue
+            for start, item in list(outstanding.items()):
+                if monotonic() > item[2]:
+                    print(f"Range {start} to {item[0] - 1} was not reported in time! Handing it out again...")
+                    del outstanding[start]
+                    pending.appendleft((start, item[0], item[1]))
+            while pending and waiting:
+                start, end, progress = pending.popleft()
+                self.send(f"{self.itemsTopic}/{waiting.popleft()}", {"start": start, "end": end, "from": progress})
+                outstanding[start] = [end, progress, monotonic() + self.timeout]
+        journal.finish()
+        self.send(self.controlTopic, {"finished": True})
+        print("Every range of the pass was completed!")
+        return
+    
+    # ranges handed to this worker as (start, end, first id to scrap) tuples, until the coordinator announces the pass is finished
+    # a worker started while no coordinator is running waits for the next one
+    # a new range is asked for every time the previous one is done, and again every retry seconds while waiting
+    def items(self, retry=30):
+        self.subscribe(self.controlTopic)
+        self.subscribe(f"{self.itemsTopic}/{self.worker}")
+        self.connected.wait()
+        request = True
+        while True:
+            if request: self.send(self.requestsTopic, {"worker": self.worker})
+            try:
+                topic, message = self.messages.get(timeout=retry)
+            except Empty:
+                request = True
+                continue
+            if message.get("finished"):
+                return
+            request = "start" in message
+            if request:
+                self.stamp = monotonic()
+                yield message["start"], message["end"], message.get("from", message["start"])
+    
+    # report the first id of a range not completed yet, at most every heartbeat seconds unless the range is done
+    def report(self, start, progress, done=False):
+        if not done and monotonic() - self.stamp < self.heartbeat: return
+        self.stamp = monotonic()
+        self.send(self.acksTopic, {"worker": self.worker, "start": start, "from": progress, "state": "done" if done else "working"})
+        return
+    
+    def close(self, timeout=5):
+        try:
+            if self.last: self.last.wait_for_publish(timeout)
+        except Exception:
+            pass
+        self.client.disconnect()
+        self.client.loop_stop()
+        return
+
+# latency histograms and counters of every stage of the scrapping, safe to share between threads and dbScrapper objects
+# stats are kept per table and exposed as prometheus text on http://host:port/metrics and/or written as json to a file every interval seconds
+class scrapMetrics():
+    # histogram buckets upper bounds in seconds
+    buckets = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+    # counters of the final outcome of every fetched id
+    idEvents = ["found", "notModified", "notFound", "invalid"]
+    
+    def __init__(self, port=0, file="", interval=10, host=""):
+        self.stamp = monotonic()
+        # {(table, stage): [count, seconds, [count per bucket]]} and {(table, event): count}
+        self.stages = {}
+        self.counters = {}
+        # ids per table and time of the previous snapshot, to report the recent rate
+        self.previous = {}
+        self.lock = Lock()
+        self.file = file
+        self.interval = interval
+        self.stopped = Event()
+        self.server = False
+        self.writer = False
+        if port:
+            self.serve(host, port)
+        if file:
+            self.writer = Thread(target=self.run, name="scrapMetrics", daemon=True)
+            self.writer.start()
+        return
+    
+    # time the block of a with statement as stage of table
+    @contextmanager
+    def timer(self, stage, table=""):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, monotonic() - start, table)
+    
+    def observe(self, stage, seconds, table=""):
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            stats = self.stages.get((table, stage))
+            if stats is None:
+                stats = self.stages[(table, stage)] = [0, 0.0, [0] * (len(self.buckets) + 1)]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2][bucket] += 1
+        return
+    
+    def count(self, event, table="", n=1):
+        with self.lock:
+            self.counters[(table, event)] = self.counters.get((table, event), 0) + n
+        return
+    
+    # current stats as a dictionary: {"uptime": seconds, "tables": {table: {"idsPerSecond", "recentIdsPerSecond", "notFoundRatio", "counters", "stages"}}}
+    # the recent rate is measured since the previous snapshot taken with mark set
+    def snapshot(self, mark=True):
+        now = monotonic()
+        with self.lock:
+            stages = {k: (v[0], v[1], list(v[2])) for k, v in self.stages.items()}
+            counters = dict(self.counters)
+        uptime = now - self.stamp
+        tables = {}
+        for (table, event), n in counters.items():
+            tables.setdefault(table, {"counters": {}, "stages": {}})["counters"][event] = n
+        for (table, stage), (n, seconds, buckets) in stages.items():
+            cumulative, total = {}, 0
+            for le, b in zip(self.buckets + ["+Inf"], buckets):
+                total += b
+                cumulative[str(le)] = total
+            tables.setdefault(table, {"counters": {}, "stages": {}})["stages"][stage] = \
+                {"count": n, "seconds": seconds, "average": seconds / n if n else 0, "buckets": cumulative}
+        for table, stats in tables.items():
+            ids = sum(stats["counters"].get(e, 0) for e in self.idEvents)
+            lastIds, lastTime = self.previous.get(table, (0, self.stamp))
+            if mark: self.previous[table] = (ids, now)
+            stats["ids"] = ids
+            stats["idsPerSecond"] = ids / uptime if uptime else 0
+            stats["recentIdsPerSecond"] = (ids - lastIds) / (now - lastTime) if now > lastTime else 0
+            stats["notFoundRatio"] = stats["counters"].get("notFound", 0) / ids if ids else 0
+        return {"uptime": uptime, "tables": tables}
+    
+    # current stats in the prometheus text exposition format
+    def prometheus(self):
+        snapshot = self.snapshot(False)
+        lines = ["# TYPE dbscrapper_uptime_seconds gauge", f"dbscrapper_uptime_seconds {snapshot['uptime']}"]
+        events = ["# TYPE dbscrapper_events_total counter"]
+        stages = ["# TYPE dbscrapper_stage_seconds histogram"]
+        rates = ["# TYPE dbscrapper_ids_per_second gauge"]
+        ratios = ["# TYPE dbscrapper_not_found_ratio gauge"]
+        for table, stats in snapshot["tables"].items():
+            for event, n in stats["counters"].items():
+                events.append(f'dbscrapper_events_total{{table="{table}",event="{event}"}} {n}')
+            for stage, s in stats["stages"].items():
+                for le, n in s["buckets"].items():
+                    stages.append(f'dbscrapper_stage_seconds_bucket{{table="{table}",stage="{stage}",le="{le}"}} {n}')
+                stages.append(f'dbscrapper_stage_seconds_sum{{table="{table}",stage="{stage}"}} {s["seconds"]}')
+                stages.append(f'dbscrapper_stage_seconds_count{{table="{table}",stage="{stage}"}} {s["count"]}')
+            rates.append(f'dbscrapper_ids_per_second{{table="{table}"}} {stats["idsPerSecond"]}')
+            ratios.append(f'dbscrapper_not_found_ratio{{table="{table}"}} {stats["notFoundRatio"]}')
+        return "\n".join(lines + events + stages + rates + ratios) + "\n"
+    
+    # serve the prometheus text from a background thread
+    def serve(self, host, port):
+        metrics = self
+        class handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ["/", "/metrics"]:
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                return
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        Thread(target=self.server.serve_forever, name="scrapMetricsServer", daemon=True).start()
+        print(f"Metrics served on port {self.server.server_address[1]}!")
+        return
+    
+    # write the json stats file every interval seconds
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+        return
+    
+    # replace the json stats file atomically
+    def write(self):
+        try:
+            with open(self.file + ".tmp", "w") as file:
+                file.write(json.dumps(self.snapshot(), indent=4))
+            os.replace(self.file + ".tmp", self.file)
+        except OSError as e:
+            print(f"Couldn't write metrics file! ({e})")
+        return
+    
+    # stop the exporters, writing the stats file one last time
+    def close(self):
+        self.stopped.set()
+        if self.writer:
+            self.writer.join()
+            self.write()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        return
 
 # create the dbScrapper class
 class dbScrapper():
     # initialize class instance
-    def __init__(self, config, delay=False, encode=False):
+    def __init__(self, config, delay=False, encode=False, session=False, pool=False, limiter=False, replay=False, metrics=False, quiet=False, retry=False):
         # load configuration parameters from json file
         try:
             with open(config, 'r') as file:
@@ -40,27 +1341,9 @@ class dbScrapper():
             with open(config, "w") as file:
                 file.write(json.dumps(defDataBaseConfig, indent=4))
             exit()
-        # initialize database connection and create a MySQLConnection object
-        counter = 0
-        while counter < 3:
-            try:
-                self.db = mysql.connector.connect(
-                    host = conf["database"]["host"],
-                    port = conf["database"]["port"],
-                    user = conf["database"]["user"],
-                    password = conf["database"]["password"],
-                    database = conf["database"]["database"]
-                )
-                break
-            except:
-                print("Error while connecting to database! Trying again...")
-                counter += 1
-                sleep(5)
-        else:
-            print("Couldn't connect to database! Terminating program...")
-            raise Exception("Couldn't connect to database!")
-        # self.db cursor
-        self.dbCursor = self.db.cursor()
+        # database connection pool (can be shared between objects)
+        self.ownPool = not pool
+        self.pool = pool if pool else dbPool(conf["database"])
         # api url
         self.api = conf["api"]
         # database table name
@@ -77,8 +1360,70 @@ class dbScrapper():
             self.delay = delay
         else:
             self.delay = conf["delay"]
+        # api rate limiter (can be shared between objects), a custom delay or a config without rateLimit means one request per delay
+        if limiter:
+            self.limiter = limiter
+        elif not delay and "rateLimit" in conf:
+            self.limiter = rateLimiter(conf["rateLimit"]["rate"], conf["rateLimit"].get("burst", 1), conf["rateLimit"].get("minRate", False))
+        else:
+            self.limiter = rateLimiter(1 / self.delay if self.delay else 1000)
+        # retry policy and circuit breaker of the api requests (can be shared between objects)
+        if retry:
+            self.retry = retry
+        else:
+            retryConf = conf.get("retry", {})
+            self.retry = retryPolicy(retryConf.get("base", 1), retryConf.get("cap", 60), retryConf.get("budgets", False), \
+                retryConf.get("threshold", 5), retryConf.get("cooldown", 30), retryConf.get("maxCooldown", 300))
+        # http session (can be shared between objects) and (connect, read) timeouts
+        httpConf = conf.get("http", {})
+        self.ownSession = not session
+        self.session = session if session else httpSession(httpConf.get("poolSize", 10))
+        self.timeout = tuple(httpConf.get("timeout", [5, 30]))
+        # batched writes, up to batchSize rows or batchInterval seconds are queued (size 0 writes every entry on its own)
+        batchConf = conf.get("batch", {})
+        self.batchSize = batchConf.get("size", 0)
+        self.batchInterval = batchConf.get("interval", 5)
+        # queued (updated columns, row) tuples, the updated columns are the mapped ones present in the entry
+        self.batchRows = []
+        self.batchStamp = monotonic()
+        self.batchLock = Lock()
+        # windowed preload of existing rows, preloadSize ids are read at once starting from the first one not in the window
+        self.preloadSize = conf.get("preload", 0)
+        self.preloadStart = None
+        self.preloadRows = {}
+        # local fingerprint store used to skip unchanged entries without querying the database
+        self.fingerprints = fingerprintStore(conf["fingerprints"]) if conf.get("fingerprints") else False
+        self.batchDigests = []
+        # validators of the last response of every id, stored with its fingerprint once the entry is known to be in the database
+        self.validators = {}
+        # refresh priority settings, entries with the statusColumn (api) value in activeValues are activeWeight times more likely to be refreshed
+        refreshConf = conf.get("refresh", {})
+        self.statusColumn = refreshConf.get("statusColumn", "")
+        self.activeValues = refreshConf.get("activeValues", [1])
+        self.activeWeight = refreshConf.get("activeWeight", 10)
+        # ids known to be missing from the api, skipped by dataFeed until their ttl expires
+        tombstonesConf = conf.get("tombstones", {})
+        self.tombstones = tombstoneSet(tombstonesConf["file"], tombstonesConf.get("ttl", 30)) if tombstonesConf.get("file") else False
+        # verification after every write: "full" re-reads the entry, "rowcount" trusts the affected rows and "sample:N" re-reads 1 in N entries
+        self.verify = conf.get("verify", "full")
+        self.verifySample = int(self.verify.split(":")[1]) if self.verify.startswith("sample:") else 1
+        # raw response cache, and replay mode serving every request only from it
+        self.cache = responseCache(conf["cache"]) if conf.get("cache") else False
+        self.replay = replay
+        # per stage latency histograms and counters (can be shared between objects), exported as configured in metrics
+        self.ownMetrics = not metrics
+        if metrics:
+            self.metrics = metrics
+        else:
+            metricsConf = conf.get("metrics", {})
+            self.metrics = scrapMetrics(metricsConf.get("port", 0), metricsConf.get("file", ""), metricsConf.get("interval", 10))
+        if replay and not self.cache:
+            print("Replay mode needs a response cache! Terminating program...")
+            raise Exception("Replay mode needs a response cache!")
         # select if internally encode data
         self.encodeData = encode
+        # print the progress of every entry (quiet skips it, formatting included)
+        self.verbose = not quiet
         # (database) : (api) dictionary
         self.dbCols = {}
         for k in self.apiKeys:
@@ -86,11 +1431,26 @@ class dbScrapper():
         # keys only from self.dbCols
         self.dbKeys = list(self.dbCols.keys())
         # columns in database table
-        self.dbCursor.execute(f"DESCRIBE `{conf['table']}`")
-        cols = list(self.dbCursor.fetchall())
+        cols, _ = self.pool.execute(f"DESCRIBE `{conf['table']}`", prepared=False)
         self.tableCols = []
         for c in cols:
             self.tableCols.append(c[0])
+        # conversion plan of every mapped api key, (api key, converter of its column type)
+        columnTypes = {c[0]: c[1] for c in cols}
+        # api keys kept from every response, the mapped ones plus the refresh status one
+        self.projectKeys = self.apiKeys + ([self.statusColumn] if self.statusColumn and self.statusColumn not in self.apiKeys else [])
+        self.convertPlan = [(k, columnConverter(columnTypes[self.apiCols[k]]) if self.apiCols[k] in columnTypes else convertValue) for k in self.apiKeys]
+        # converter of the values read from every table column and diff plan of the mapped ones, (row index, column, api key, converter)
+        self.rowConverters = [rowConverter(columnTypes[c]) for c in self.tableCols]
+        self.diffPlan = [(i, c, self.dbCols[c], self.rowConverters[i]) for i, c in enumerate(self.tableCols) if c in self.dbCols]
+        # statements prepared once per table and connection (see dbPool.execute) and executed with bound parameters
+        tableCols = ",".join(f"`{c}`" for c in self.tableCols)
+        self.rowMarks = "(" + ",".join(["%s"] * len(self.tableCols)) + ")"
+        self.sqlSelect = f"SELECT * FROM `{self.dbTable}` WHERE `{self.uniqueId}`=%s"
+        self.sqlPreload = f"SELECT * FROM `{self.dbTable}` WHERE `{self.uniqueId}` BETWEEN %s AND %s"
+        self.sqlUpdates = {}
+        self.sqlInsert = f"INSERT INTO `{self.dbTable}` ({tableCols}) VALUES {self.rowMarks}"
+        self.sqlUpserts = {}
         print("New dbScrapper object created!")
         return
     
@@ -109,143 +1469,456 @@ class dbScrapper():
         return text
 
     # fetch data info from self.api
-    # returns 'data' (json formatted data) if it found a result, and False if it did not found anything
+    # returns 'data' (json formatted data) if it found a result, True if it was not modified since its last fetch and False if it did not found anything
     def dataGet(self, fetch):
-        data = rq.get(f"{self.api}/{fetch}")
-        sleep(self.delay)
+        # ask for the entry only if it changed since the response its fingerprint was stored from
+        headers = {}
+        validators = self.fingerprints.validators(fetch) if self.fingerprints and not self.replay else None
+        if validators:
+            if validators[0]: headers["If-None-Match"] = validators[0]
+            if validators[1]: headers["If-Modified-Since"] = validators[1]
+        try:
+            data = self.httpGet(f"{self.api}/{fetch}", headers)
+        except rq.exceptions.Timeout:
+            print(f"Request for Id:{fetch} timed out!")
+            self.limiter.feedback(504)
+            self.metrics.count("timeout", self.dbTable)
+            self.retry.failure(fetch, "timeout")
+            return None
+        except networkErrors as e:
+            print(f"Request for Id:{fetch} failed! ({type(e).__name__})")
+            self.limiter.feedback(503)
+            self.metrics.count("retry", self.dbTable)
+            self.retry.failure(fetch, "network")
+            return None
+        if data.status_code not in self.retry.statusClasses: self.retry.success(fetch)
+        if data.status_code == 304:
+            if self.verbose: print(f"Entry with Id:{fetch} not modified!")
+            self.fingerprints.touch(fetch)
+            self.metrics.count("notModified", self.dbTable)
+            return True
         if data.status_code in [200, 201]:
-            print(f"Entry with Id:{fetch} found!")
-            # encode text data in utf-8 and save in data variable
-            data = self.encodeText(data.json()) if self.encodeData else data.json()
+            if self.verbose: print(f"Entry with Id:{fetch} found!")
+            if self.tombstones and not self.replay: self.tombstones.discard(fetch)
+            if self.fingerprints and not self.replay and (data.headers.get("ETag") or data.headers.get("Last-Modified")):
+                self.validators[fetch] = (data.headers.get("ETag"), data.headers.get("Last-Modified"))
+            # keep only the projected keys, dropping the unmapped blobs right after decoding, and encode their text data in utf-8
+            with self.metrics.timer("decode", self.dbTable):
+                data = jsonLoads(data.content)
+                if type(data) is dict:
+                    data = {k: data[k] for k in self.projectKeys if k in data}
+                    if self.encodeData: data = self.encodeText(data)
             if type(data) is dict:
-                for x in data:
-                    if not type(data[x]) in NUMERIC_TYPES:
-                        # print(f"\t├─To be changed: {x}")
-                        if type(data[x]) is NoneType:
-                            data[x] = "null"
-                        elif type(data[x]) is bool:
-                            data[x] = int(data[x])
-                        else:
-                            data[x] = str(data[x]).replace("\\","\\\\").replace("\"","\\\"")
-                    else:
-                        if not type(data[x]) is int: data[x] = float(data[x])
+                # convert only the mapped keys into the type of their column
+                with self.metrics.timer("normalize", self.dbTable):
+                    for k, convert in self.convertPlan:
+                        if k in data: data[k] = convert(data[k])
+                self.metrics.count("found", self.dbTable)
                 return data
             else:
                 print("Data is not a dictionary!")
         elif data.status_code == 404:
-            print(f"Entry with Id:{fetch} not found!")
+            if self.verbose: print(f"Entry with Id:{fetch} not found!")
+            # in replay mode a 404 may only mean the url is not cached, so it is not tombstoned
+            if self.tombstones and not self.replay: self.tombstones.add(fetch)
+            self.metrics.count("notFound", self.dbTable)
+            return False
         elif data.status_code in [400, 401, 403, 405, 409]:
             print("Invalid request!")
-        elif data.status_code in [500, 503]:
+        elif data.status_code == 429:
+            print("Too many requests! Slowing down...")
+            self.metrics.count("retry", self.dbTable)
+            self.retry.failure(fetch, "throttle")
+            return None
+        elif data.status_code in [500, 502, 503, 504]:
             print("Service not available right now!")
+            self.metrics.count("retry", self.dbTable)
+            self.retry.failure(fetch, "server")
             return None
         else:
-            print("Unknown status code: " + data.status_code)
+            print("Unknown status code: " + str(data.status_code))
+        self.metrics.count("invalid", self.dbTable)
         return False
     
-    # check if data (dictionary parsed from API request) is already in the database table (self.dbTable) and if data values are the same (shows each column)
-    # returns result (data exists on database or not), different (data in database is different than the one being checked), query(returns the database query)
-    def dataExists(self, data):
-        print("Checking data existance within the database...")
-        self.dbCursor.execute(f"SELECT * FROM `{self.dbTable}` WHERE `{self.uniqueId}`={data[self.dbCols[self.uniqueId]]}")
-        query = self.dbCursor.fetchall()
-        # return False if there is no result
-        if not query: return False
-        # database query column dictionary
-        queryDict = {}
-        for k in range(len(self.tableCols)):
-            if not type(query[0][k]) in NUMERIC_TYPES:
-                # print(f"\t├─To be changed: {x}")
-                if type(query[0][k]) is NoneType:
-                    queryDict[self.tableCols[k]] = "null"
-                elif type(query[0][k]) is bool:
-                    queryDict[self.tableCols[k]] = int(query[0][k])
+    # get url through the rate limiter and the response cache
+    # in replay mode the response comes only from the cache (a 404 if it is not cached), otherwise found and not found responses are cached
+    def httpGet(self, url, headers={}):
+        if self.replay:
+            with self.metrics.timer("fetch", self.dbTable):
+                response = self.cache.read(url)
+            if response is None:
+                response = rq.models.Response()
+                response.status_code = 404
+            return response
+        with self.metrics.timer("wait", self.dbTable):
+            self.retry.wait()
+            self.limiter.acquire()
+        # the circuit breaker counts network errors, timeouts and 5xx responses as failures
+        try:
+            with self.metrics.timer("fetch", self.dbTable):
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except (rq.exceptions.Timeout,) + networkErrors:
+            self.retry.record(False)
+            raise
+        self.retry.record(response.status_code < 500)
+        self.limiter.feedback(response.status_code, response.headers.get("Retry-After"))
+        if self.cache and response.status_code in [200, 201, 404]:
+            self.cache.write(url, response)
+        return response
+    
+    # request fetch again after dataGet returned None, sleeping the backoff delay of the retry policy before every attempt
+    # returns the first result that is not None, or None once the retry budget of its error class is spent
+    def dataRetry(self, fetch):
+        while self.retry.backoff(fetch):
+            data = self.dataGet(fetch)
+            if data is not None:
+                return data
+        print(f"Retry budget of Id:{fetch} spent! Skipping it...")
+        self.metrics.count("exhausted", self.dbTable)
+        return None
+    
+    # check if fetch is a tombstoned id that should not be requested again yet
+    def dataMissing(self, fetch):
+        if self.tombstones and self.tombstones.has(fetch):
+            if self.verbose: print(f"Entry with Id:{fetch} is known to be missing! Skipping it...")
+            self.metrics.count("tombstoned", self.dbTable)
+            return True
+        return False
+    
+    # fetch data from self.api for every id in ids, keeping up to 'prefetch' upcoming ids in flight on a pool of workers
+    # yields (id, data) tuples in the same order as ids, where data is the result of dataGet for that id (False for tombstoned ids)
+    def dataFeed(self, ids, prefetch=0):
+        if not prefetch or prefetch < 1:
+            for i in ids:
+                # queued rows are written once due even while no entry reaches dataInsert (not found, tombstoned or skipped ids)
+                self.dataFlush(True)
+                yield i, False if self.dataMissing(i) else self.dataGet(i)
+            return
+        ids = iter(ids)
+        window = deque()
+        inflight = 0
+        # tombstoned ids take no request, but still a place in the window (up to windowSize ids ahead)
+        windowSize = prefetch * 4
+        workers = ThreadPoolExecutor(max_workers=prefetch)
+        try:
+            while True:
+                # keep the window filled up to prefetch requests in flight
+                while inflight < prefetch and len(window) < windowSize:
+                    try:
+                        i = next(ids)
+                    except StopIteration:
+                        break
+                    if self.dataMissing(i):
+                        window.append((i, False))
+                    else:
+                        window.append((i, workers.submit(self.dataGet, i)))
+                        inflight += 1
+                if not window: break
+                self.dataFlush(True)
+                # hand out the oldest result
+                i, future = window.popleft()
+                if future:
+                    inflight -= 1
+                    yield i, future.result()
                 else:
-                    queryDict[self.tableCols[k]] = str(query[0][k]).replace("\\","\\\\").replace("\"","\\\"")
-            else:
-                if type(query[0][k]) is int: queryDict[self.tableCols[k]] = query[0][k]
-                else: queryDict[self.tableCols[k]] = float(query[0][k])
-        # entire content of the query as list of dictionaries per row in database
-        queryContent = []
+                    yield i, False
+        finally:
+            workers.shutdown(wait=False, cancel_futures=True)
+        return
+    
+    # load the rows of the ids from start to start+self.preloadSize into self.preloadRows
+    def dataPreload(self, start):
+        query, _ = self.pool.execute(self.sqlPreload, (start, start + self.preloadSize - 1))
+        uniqueIndex = self.tableCols.index(self.uniqueId)
+        rows = {}
         for r in query:
-            row = {}
-            for c in range(len(self.tableCols)):
-                row[self.tableCols[c]] = r[c]
-            queryContent.append(row)
-        #print(query)
-        result = False
-        different = False
-        # compares data from database and parsed
-        print(f"\t├─Same '{self.uniqueId}' found in database!")
-        dataKeys = list(data.keys())
-        for k in self.tableCols:
-            queryVal = queryDict[k]
-            if k in dataKeys:
-                if queryVal == data[self.dbCols[k]]:
-                    colCheck = True
-                    result = True
-                else:
-                    colCheck = False
-                    different = True
-                print(f"\t│\t├─Same {k}: {colCheck}")
-                #print(f"{queryVal} || {data[self.dbCols[k]]}")
-        print(f"\t└─Data exists in database:\n\t\t├─result:{result}\n\t\t└─different:{different}")
-        return [result,different,queryContent]
+            rows.setdefault(r[uniqueIndex], []).append(r)
+        self.preloadStart = start
+        self.preloadRows = rows
+        return
+    
+    # check if fetch is inside the loaded preload window (no window is loaded before the first preload)
+    def dataPreloaded(self, fetch):
+        return self.preloadStart is not None and self.preloadStart <= fetch < self.preloadStart + self.preloadSize
+    
+    # mark the preloaded rows of fetch as stale after it was written, so its next lookup queries the database
+    def dataStale(self, fetch):
+        if self.dataPreloaded(fetch): self.preloadRows[fetch] = None
+        return
+    
+    # get the database rows with the unique column equal to fetch
+    # uses the preload window when cached is True, otherwise queries the database and refreshes the window entry
+    def dataQuery(self, fetch, cached=True):
+        window = self.preloadSize > 0 and type(fetch) is int
+        if window and cached:
+            if not self.dataPreloaded(fetch):
+                self.dataPreload(fetch)
+            rows = self.preloadRows.get(fetch, [])
+            if rows is not None: return rows
+        query, _ = self.pool.execute(self.sqlSelect, (fetch,))
+        if window and self.dataPreloaded(fetch):
+            self.preloadRows[fetch] = query
+        return query
+    
+    # check if data (dictionary parsed from API request) is already in the database table (self.dbTable) comparing the typed values of its mapped columns
+    # returns None if the entry is not in the database, otherwise the set of columns with different values (empty when the entry has no changes)
+    def dataExists(self, data, cached=True):
+        if self.verbose: print("Checking data existance within the database...")
+        with self.metrics.timer("select", self.dbTable):
+            query = self.dataQuery(data[self.dbCols[self.uniqueId]], cached)
+        if not query: return None
+        changed = self.dataDiff(data, query[0])
+        if self.verbose: print(f"\t└─Same '{self.uniqueId}' found in database with {len(changed)} different columns{': ' + ', '.join(sorted(changed)) if changed else ''}")
+        return changed
+    
+    # columns of a database row with values different from data, in one pass over the diff plan
+    def dataDiff(self, data, row):
+        changed = set()
+        for i, column, key, convert in self.diffPlan:
+            if key in data:
+                value = row[i]
+                if convert is not None and value is not None: value = convert(value)
+                if value != data[key]: changed.add(column)
+        return changed
+    
+    # normalize a database row the same way dataGet converts the api data
+    # returns a (database column) : (value) dictionary
+    def rowNormalize(self, row):
+        rowDict = {}
+        for k, convert in enumerate(self.rowConverters):
+            rowDict[self.tableCols[k]] = row[k] if convert is None or row[k] is None else convert(row[k])
+        return rowDict
+    
+    # update statement of columns, the same sql object is reused for every set of columns so it stays prepared
+    def sqlUpdate(self, columns):
+        key = tuple(columns)
+        if key not in self.sqlUpdates:
+            self.sqlUpdates[key] = f"UPDATE `{self.dbTable}` SET {','.join(f'`{c}`=%s' for c in columns)} WHERE `{self.uniqueId}`=%s"
+        return self.sqlUpdates[key]
+    
+    # multi-row upsert (with a {} placeholder for the rows) updating only columns of the existing rows
+    # without columns the existing rows are left as they are
+    def sqlUpsert(self, columns):
+        key = tuple(columns)
+        if key not in self.sqlUpserts:
+            tableCols = ",".join(f"`{c}`" for c in self.tableCols)
+            updates = ",".join(f"`{c}`=VALUES(`{c}`)" for c in columns) if columns else f"`{self.uniqueId}`=`{self.uniqueId}`"
+            self.sqlUpserts[key] = f"INSERT INTO `{self.dbTable}` ({tableCols}) VALUES {{}} ON DUPLICATE KEY UPDATE {updates}"
+        return self.sqlUpserts[key]
+    
+    # hash the mapped table columns of values, a (database column) : (value) dictionary
+    def valuesHash(self, values):
+        content = [[c, values[c]] for c in self.tableCols if c in values]
+        return hashlib.blake2b(json.dumps(content, default=str).encode("utf-8"), digest_size=16).hexdigest()
+    
+    # hash of data (dictionary parsed from API request) comparable with the hash of its normalized database row
+    def dataHash(self, data):
+        values = {}
+        for c in self.tableCols:
+            k = self.dbCols.get(c)
+            if k in data: values[c] = data[k]
+        return self.valuesHash(values)
+    
+    # store the fingerprint of an entry known to be in the database, counting if it changed since the last check
+    # replayed entries were not fetched from the api, so only their hash is kept in sync with the database
+    def dataRemember(self, fetch, digest, changed, active):
+        if not digest: return
+        if self.replay:
+            self.fingerprints.setHash(fetch, digest)
+        else:
+            self.fingerprints.set(fetch, digest, changed, active, *self.validators.pop(fetch, (None, None)))
+        return
+    
+    # check if data is still active (airing/publishing) according to the refresh settings
+    def dataActive(self, data):
+        return bool(self.statusColumn) and data.get(self.statusColumn) in self.activeValues
+    
+    # ids of the count entries of the fingerprint store most likely to have changed
+    # entries are scored by the time since they were last fetched, how often they changed and if they are still active
+    def refreshQueue(self, count):
+        if not self.fingerprints:
+            print("No fingerprint store configured!")
+            return []
+        now = time()
+        scores = []
+        for fetch, fetched, checks, changes, active in self.fingerprints.stats():
+            changeRate = (changes + 1) / (checks + 2)
+            scores.append((-(now - fetched) * changeRate * (self.activeWeight if active else 1), fetch))
+        heapq.heapify(scores)
+        queue = []
+        while scores and len(queue) < count:
+            queue.append(heapq.heappop(scores)[1])
+        return queue
+    
+    # rebuild the fingerprint store from every row of the database table
+    # returns the number of entries in the store
+    def fingerprintRebuild(self):
+        if not self.fingerprints:
+            print("No fingerprint store configured!")
+            return 0
+        uniqueIndex = self.tableCols.index(self.uniqueId)
+        mapped = [c for c in self.tableCols if c in self.dbCols]
+        query, _ = self.pool.execute(f"SELECT * FROM `{self.dbTable}`", prepared=False)
+        entries = []
+        for r in query:
+            rowDict = self.rowNormalize(r)
+            entries.append((r[uniqueIndex], self.valuesHash({c: rowDict[c] for c in mapped})))
+        count = self.fingerprints.rebuild(entries)
+        print(f"Fingerprint store rebuilt with {count} entries!")
+        return count
     
     # insert or update an anime entry in the database and finally check if it is found int he database
     # prints id, mal_id and title if the entry was added and found in the database
-    def dataInsert(self, data):
-        dataKeys = list(data.keys())
-        check = self.dataExists(data)
-        if not check:
-            print("Entry not found in the database! Creating it...")
-            dbEntry = f"INSERT INTO `{self.dbTable}` VALUES ("
-            for c in self.tableCols:
-                k = self.dbCols[c]
-                if k in dataKeys:
-                    dbEntry += str(f"\"{data[k]}\"") if type(data[k]) is str and not data[k] == "null" else str(data[k])
-                else:
-                    dbEntry += "null"
-                if c != self.apiKeys[-1]: dbEntry += ","
-            dbEntry += ")"
-            #print(dbEntry)
-            self.dbCursor.execute(dbEntry)
-            print("\t├─Checking data added succesfully... ")
-        elif check[0] and check[1]:
-            print("Entry was found with different values! Updating it...")
-            dbUpdate = f"UPDATE `{self.dbTable}` SET "
-            for c in self.tableCols:
-                k = self.dbCols[c]
-                if k in dataKeys:
-                    dbUpdate += f"`{c}`=\"{data[k]}\"" if type(data[k]) is str and not data[k] == "null" else f"`{c}`={data[k]}"
-                    if c != self.apiKeys[-1]: dbUpdate += ", "
-            dbUpdate += f" WHERE {self.uniqueId}={data[self.dbCols[self.uniqueId]]}"
-            #print(dbUpdate)
-            self.dbCursor.execute(dbUpdate)
-            print("\t├─Checking data was updated succesfully... ")
+    # cached False looks the entry up in the database instead of the preload window (for ids not in order)
+    def dataInsert(self, data, cached=True):
+        # entry not modified since its last fetch (see dataGet)
+        if data is True:
+            if self.verbose: print("Entry was not modified since its last fetch!")
+            return True
+        fetch = data[self.dbCols[self.uniqueId]]
+        # skip the database entirely when the fingerprint of the entry did not change
+        digest = self.dataHash(data) if self.fingerprints else False
+        active = self.dataActive(data)
+        if digest and self.fingerprints.get(fetch) == digest:
+            if self.verbose: print("Entry fingerprint has no changes! Skipping it...")
+            self.dataRemember(fetch, digest, False, active)
+            self.metrics.count("skipped", self.dbTable)
+            return True
+        check = self.dataExists(data, cached)
+        if self.batchSize > 0:
+            if check is None or check:
+                if self.verbose: print("Entry is new or has different values! Queueing it...")
+                with self.batchLock:
+                    # the batch interval counts from the first row queued
+                    if not self.batchRows: self.batchStamp = monotonic()
+                    self.batchRows.append((self.dataColumns(data), self.dataRow(data)))
+                    self.batchDigests.append((fetch, digest, active))
+                # the preloaded row no longer matches what the database will hold
+                self.dataStale(fetch)
+                self.metrics.count("queued", self.dbTable)
+            else:
+                if self.verbose: print("Entry was found in the database with no changes!")
+                self.dataRemember(fetch, digest, False, active)
+                self.metrics.count("unchanged", self.dbTable)
+            self.dataFlush(True)
+            return True
+        if check is None:
+            if self.verbose: print("Entry not found in the database! Creating it...")
+            with self.metrics.timer("write", self.dbTable):
+                _, affected = self.pool.execute(self.sqlInsert, self.dataRow(data))
+            self.metrics.count("inserted", self.dbTable)
+        elif check:
+            if self.verbose: print("Entry was found with different values! Updating it...")
+            # update only the changed columns
+            updateCols = [c for c in self.tableCols if c in check]
+            with self.metrics.timer("write", self.dbTable):
+                _, affected = self.pool.execute(self.sqlUpdate(updateCols), [data[self.dbCols[c]] for c in updateCols] + [fetch])
+            self.metrics.count("updated", self.dbTable)
         else:
-            print("Entry was found in the database with no changes!")
+            if self.verbose: print("Entry was found in the database with no changes!")
+            self.dataRemember(fetch, digest, False, active)
+            self.metrics.count("unchanged", self.dbTable)
             return True
-        self.db.commit()
-        entry = self.dataExists(data)
+        # trust the affected rows count unless the verification policy asks to re-read this entry
+        if self.verify == "rowcount" or (self.verifySample > 1 and random.randrange(self.verifySample)):
+            self.dataStale(fetch)
+            if affected == 1:
+                if self.verbose: print(f"Entry was written to the database!\n\t└─{self.uniqueId}: {fetch}\n")
+                self.dataRemember(fetch, digest, True, active)
+                return True
+            elif affected > 1:
+                print("Entry was written multiple times in the database! Please check database.")
+            else:
+                print("Entry was not written to the database! Check the system.")
+            self.metrics.count("failed", self.dbTable)
+            return False
+        if self.verbose: print("\t├─Checking data was written succesfully... ")
+        with self.metrics.timer("verify", self.dbTable):
+            entry = self.dataQuery(fetch, False)
         if not entry:
             print("Entry was not found in the database! Check the system.")
             return False
-        elif entry[0] and not entry[1]:
-            if len(entry[2]) == 1:
-                print(f"Entry was found in the database!\n\t└─{self.uniqueId}: {entry[2][0][self.uniqueId]}\n")
-                return True
-            elif len(entry[2]) > 1:
-                print("Entry was found multiple times in the database! Please check database.")
-        elif entry[0] and entry[1]:
+        elif len(entry) > 1:
+            print("Entry was found multiple times in the database! Please check database.")
+        elif self.dataDiff(data, entry[0]):
             print("Entry was found with different values! Check the system.")
+        else:
+            if self.verbose: print(f"Entry was found in the database!\n\t└─{self.uniqueId}: {fetch}\n")
+            self.dataRemember(fetch, digest, True, active)
+            return True
+        self.metrics.count("failed", self.dbTable)
         return False
     
+    # values of data following the table columns order, None for the columns missing in data
+    def dataRow(self, data):
+        row = []
+        for c in self.tableCols:
+            k = self.dbCols.get(c)
+            row.append(data[k] if k in data else None)
+        return tuple(row)
+    
+    # mapped table columns (other than the unique one) with a value in data, the columns a queued row updates
+    def dataColumns(self, data):
+        return tuple(c for c in self.tableCols if c != self.uniqueId and self.dbCols.get(c) in data)
+    
+    # write the queued rows with one multi-row upsert keyed on the table unique column per set of updated columns
+    # with due True the rows are only written once batchSize rows are queued or the first one has waited batchInterval seconds
+    # returns the number of entries written
+    def dataFlush(self, due=False):
+        with self.batchLock:
+            if due and (not self.batchRows or (len(self.batchRows) < self.batchSize and monotonic() - self.batchStamp < self.batchInterval)):
+                return 0
+            self.batchStamp = monotonic()
+            rows, digests = self.batchRows, self.batchDigests
+            self.batchRows, self.batchDigests = [], []
+        if not rows: return 0
+        # group the rows by their updated columns, so columns missing from an entry keep their stored values
+        groups = {}
+        for (columns, row), digest in zip(rows, digests):
+            groups.setdefault(columns, []).append(((columns, row), digest))
+        groups = list(groups.items())
+        count = 0
+        for i, (columns, group) in enumerate(groups):
+            # the number of rows changes between batches, so the upsert is bound on the client side instead of prepared
+            params = [v for (_, r), _ in group for v in r]
+            try:
+                with self.metrics.timer("write", self.dbTable):
+                    self.pool.execute(self.sqlUpsert(columns).format(",".join([self.rowMarks] * len(group))), params, False)
+            except Exception:
+                # put back the rows not written yet so a later flush can write them
+                pending = [g for _, rest in groups[i:] for g in rest]
+                with self.batchLock:
+                    self.batchRows[:0], self.batchDigests[:0] = [r for r, _ in pending], [d for _, d in pending]
+                raise
+            count += len(group)
+            self.metrics.count("flushed", self.dbTable, len(group))
+            for _, (fetch, digest, active) in group:
+                self.dataRemember(fetch, digest, True, active)
+        if self.verbose: print(f"Batch of {count} entries written to the database!")
+        return count
+    
     # close the connection with the database
     def closeConnection(self):
-        self.db.close()
+        self.dataFlush()
+        if self.fingerprints: self.fingerprints.close()
+        if self.tombstones: self.tombstones.close()
+        if self.ownPool: self.pool.close()
+        if self.ownMetrics: self.metrics.close()
+        if self.ownSession: self.session.close()
         return
 
+# rebuild the fingerprint store of a config from its database table when run directly
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", help="Specify a dbScrapper config file")
+    parser.add_argument("-r", "--rebuild-fingerprints", help="Rebuild the fingerprint store from the database table", action="store_true")
+    args = parser.parse_args()
+    if args.rebuild_fingerprints:
+        scrapper = dbScrapper(args.config)
+        scrapper.fingerprintRebuild()
+        scrapper.closeConnection()
+
 # run the next set of commands to execute it properly
 #scrapper = dbScrapper(configFile)
 #data = scrapper.dataGet(1)
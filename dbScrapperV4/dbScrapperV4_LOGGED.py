@@ -21,8 +21,8 @@ import logging
 import requests as rq
 import mysql.connector
 from os import mkdir
-from mysql.connector.utils import NUMERIC_TYPES
 from time import sleep
+from dbScrapperV4 import columnConverter, rowConverter, convertValue, logSetup
 
 # create logs folder
 try:
@@ -30,10 +30,9 @@ try:
 except:
     pass
 
-# configure logging
-logging.basicConfig(filename="logs/dbScrapperV4.log", \
-    format="%(asctime)s (%(levelname)s): %(message)s", \
-        datefmt='%d/%m/%Y (%a) %H:%M:%S >> ', level=logging.DEBUG)
+# configure logging through a queue into a rotating and compressed log file, unless the program already did
+if not logging.getLogger().handlers:
+    logSetup("logs/dbScrapperV4.log")
 
 # initialization log
 logging.debug("dbScrapperV4 initialized!")
@@ -44,7 +43,7 @@ defDataBaseConfig = {"api":"","database":{"host":"","port":3306,"user":"","passw
 # create the dbScrapper class
 class dbScrapper():
     # initialize class instance
-    def __init__(self, config, delay=False):
+    def __init__(self, config, delay=False, quiet=False):
         # load configuration parameters from json file
         try:
             with open(config, 'r') as file:
@@ -82,6 +81,8 @@ class dbScrapper():
             self.delay = delay
         else:
             self.delay = conf["delay"]
+        # print the progress of every entry (quiet skips it, formatting included)
+        self.verbose = not quiet
         # (database) : (api) dictionary
         self.dbCols = {}
         for k in self.apiKeys:
@@ -94,6 +95,10 @@ class dbScrapper():
         self.tableCols = []
         for c in cols:
             self.tableCols.append(c[0])
+        # typed conversion of the mapped api values and diff plan of the mapped columns, built from the column types (see dbScrapperV4)
+        columnTypes = {c[0]: c[1] for c in cols}
+        self.convertPlan = [(k, columnConverter(columnTypes[self.apiCols[k]]) if self.apiCols[k] in columnTypes else convertValue) for k in self.apiKeys]
+        self.diffPlan = [(i, c, self.dbCols[c], rowConverter(columnTypes[c])) for i, c in enumerate(self.tableCols) if c in self.dbCols]
         logging.debug("New dbScrapper object created")
         print("New dbScrapper object created!")
         return
@@ -101,17 +106,17 @@ class dbScrapper():
     # fetch data info from self.api
     # returns 'data' (json formatted data) if it found a result, and False if it did not found anything
     def dataGet(self, fetch):
-        logging.debug(f"dataGet called with Id {fetch}")
+        logging.debug("dataGet called with Id %s", fetch)
         data = rq.get(f"{self.api}/{fetch}")
         sleep(self.delay)
         if data.status_code in [200, 201]:
-            logging.info(f"Id {fetch} found")
-            print(f"Entry with Id:{fetch} found!")
+            logging.info("Id %s found", fetch)
+            if self.verbose: print(f"Entry with Id:{fetch} found!")
             data = data.json()
             return data
         elif data.status_code == 404:
-            logging.info(f"Id {fetch} not found")
-            print(f"Entry with Id:{fetch} not found!")
+            logging.info("Id %s not found", fetch)
+            if self.verbose: print(f"Entry with Id:{fetch} not found!")
         elif data.status_code in [400, 401, 403, 405, 409]:
             logging.error("Invalid request!")
             print(f"Invalid request!")
@@ -124,125 +129,82 @@ class dbScrapper():
             print("Unknown status code: " + data.status_code)
         return False
     
-    # check if data (dictionary parsed from API request) is already in the database table (self.dbTable) and if data values are the same (shows each column)
-    # returns result (data exists on database or not), different (data in database is different than the one being checked), query(returns the database query)
+    # get the database rows with the unique column equal to fetch
+    def dataQuery(self, fetch):
+        self.dbCursor.execute(f"SELECT * FROM `{self.dbTable}` WHERE `{self.uniqueId}`=%s", (fetch,))
+        return self.dbCursor.fetchall()
+    
+    # check if data (dictionary parsed from API request) is already in the database table (self.dbTable) comparing the typed values of its mapped columns
+    # returns None if the entry is not in the database, otherwise the set of columns with different values (empty when the entry has no changes)
     def dataExists(self, data):
         logging.debug("Checking data existance within the database")
-        print("Checking data existance within the database...")
-        self.dbCursor.execute(f"SELECT * FROM `{self.dbTable}` WHERE `{self.uniqueId}`={data[self.dbCols[self.uniqueId]]}")
-        query = self.dbCursor.fetchall()
-        # return False if there is no result
-        if not query: return False
-        # database query column dictionary
-        queryDict = {}
-        for k in range(len(self.tableCols)):
-            queryDict[self.tableCols[k]] = query[0][k]
-        # entire content of the query as list of dcitionaries pero row in database
-        queryContent = []
-        for r in query:
-            row = {}
-            for c in range(len(self.tableCols)):
-                row[self.tableCols[c]] = r[c]
-            queryContent.append(row)
-        #print(query)
-        result = False
-        different = False
-        # compares data from database and parsed
-        print(f"\t├─Same '{self.uniqueId}' found in database!")
-        dataKeys = list(data.keys())
-        for k in self.tableCols:
-            queryVal = queryDict[k]
-            if k in dataKeys:
-                if data[self.dbCols[k]] == "null": data[self.dbCols[k]] = None
-                if (type(queryVal) not in NUMERIC_TYPES and str(queryVal) == str(data[self.dbCols[k]]).replace("\\","")) or \
-                    (type(queryVal) in NUMERIC_TYPES and float(queryVal) == float(data[self.dbCols[k]])):
-                    colCheck = True
-                    result = True
-                else:
-                    colCheck = False
-                    different = True
-                print(f"\t│\t├─Same {k}: {colCheck}")
-        logging.info(f"Exists: {result} / Different: {different}")
-        print(f"\t└─Data exists in database:\n\t\t├─result:{result}\n\t\t└─different:{different}")
-        return [result,different,queryContent]
+        if self.verbose: print("Checking data existance within the database...")
+        query = self.dataQuery(data[self.dbCols[self.uniqueId]])
+        if not query: return None
+        changed = self.dataDiff(data, query[0])
+        logging.info("Exists: True / Different columns: %s", changed)
+        if self.verbose: print(f"\t└─Same '{self.uniqueId}' found in database with {len(changed)} different columns{': ' + ', '.join(sorted(changed)) if changed else ''}")
+        return changed
+    
+    # columns of a database row with values different from data, in one pass over the diff plan
+    def dataDiff(self, data, row):
+        changed = set()
+        for i, column, key, convert in self.diffPlan:
+            if key in data:
+                value = row[i]
+                if convert is not None and value is not None: value = convert(value)
+                if value != data[key]: changed.add(column)
+        return changed
     
     # insert or update an anime entry in the database and finally check if it is found int he database
     # prints id, mal_id and title if the entry was added and found in the database
     def dataInsert(self, data):
         logging.debug("Inserting data into database")
         if not type(data) is dict:
-            logging.erro("Invalid data to insert!")
+            logging.error("Invalid data to insert!")
             print("\t└─Invalid data to insert! Returning...")
             return False
-        dataKeys = list(data.keys())
-        for c in self.tableCols:
-            k = self.dbCols[c]
-            if k in dataKeys:
-                if data[k] == None: data[k] = "null"
-                if type(data[k]) is bool: data[k] = int(data[k])
-                if not str(data[k]).isnumeric():
-                    print(f"\t├─To be changed: {k}")
-                    data[k] = str(data[k]).replace('"', '\\"')
+        # convert the mapped values into the type of their column
+        for k, convert in self.convertPlan:
+            if k in data: data[k] = convert(data[k])
+        fetch = data[self.dbCols[self.uniqueId]]
         check = self.dataExists(data)
-        if not check:
+        if check is None:
             logging.debug("Entry not found. Creating it")
-            print("Entry not found in the database! Creating it...")
-            dbEntry = f"INSERT INTO `{self.dbTable}` VALUES ("
-            for c in self.tableCols:
-                k = self.dbCols[c]
-                if k in dataKeys:
-                    if data[k] is None: data[k] = "null"
-                    if not str(data[k]).isalpha() and str(data[k]).isnumeric() or data[k] == "null":
-                        dbEntry += f"{data[k]}"
-                    else:
-                        dbEntry += f"\"{data[k]}\""
-                else:
-                    dbEntry += "null"
-                if c != self.apiKeys[-1]: dbEntry += ","
-            dbEntry += ")"
-            #print(dbEntry)
-            self.dbCursor.execute(dbEntry)
+            if self.verbose: print("Entry not found in the database! Creating it...")
+            row = [data[self.dbCols[c]] if self.dbCols.get(c) in data else None for c in self.tableCols]
+            self.dbCursor.execute(f"INSERT INTO `{self.dbTable}` VALUES ({','.join(['%s'] * len(row))})", row)
             logging.debug("Checking data addition")
-            print("\t├─Checking data added succesfully... ")
-        elif check[0] and check[1]:
-            logging.debug("Entry found different. Updating it")
-            print("Entry was found with different values! Updating it...")
-            dbUpdate = f"UPDATE `{self.dbTable}` SET "
-            for c in self.tableCols:
-                k = self.dbCols[c]
-                if k in dataKeys:
-                    if data[k] is None: data[k] = "null"
-                    if str(data[k]).isnumeric() or data[k] == "null":
-                        dbUpdate += f"`{c}`={data[k]}"
-                    else:
-                        dbUpdate += f"`{c}`=\"{data[k]}\""
-                    if c != self.apiKeys[-1]: dbUpdate += ", "
-            dbUpdate += f" WHERE {self.uniqueId}={data[self.dbCols[self.uniqueId]]}"
-            #print(dbUpdate)
-            self.dbCursor.execute(dbUpdate)
+            if self.verbose: print("\t├─Checking data added succesfully... ")
+        elif check:
+            logging.debug("Entry found different. Updating columns: %s", check)
+            if self.verbose: print("Entry was found with different values! Updating it...")
+            # update only the changed columns
+            updateCols = [c for c in self.tableCols if c in check]
+            self.dbCursor.execute(f"UPDATE `{self.dbTable}` SET {','.join(f'`{c}`=%s' for c in updateCols)} WHERE `{self.uniqueId}`=%s", \
+                [data[self.dbCols[c]] for c in updateCols] + [fetch])
             logging.debug("Checking data update")
-            print("\t├─Checking data was updated succesfully... ")
+            if self.verbose: print("\t├─Checking data was updated succesfully... ")
         else:
             logging.debug("Entry found with no changes")
-            print("Entry was found in the database with no changes!")
+            if self.verbose: print("Entry was found in the database with no changes!")
             return False
         self.db.commit()
-        entry = self.dataExists(data)
+        entry = self.dataQuery(fetch)
         if not entry:
             logging.error("Entry not found. Check system!")
             print("Entry was not found in the database! Check the system.")
             return False
-        elif entry[0] and not entry[1]:
-            if len(entry[2]) == 1:
-                logging.debug("Entry found")
-                print(f"Entry was found in the database!\n\t└─{self.uniqueId}: {entry[2][0][self.uniqueId]}\n")
-                return True
-            elif len(entry[2]) > 1:
-                logging.error("Entry found multiple times. Check database!")
-                print("Entry was found multiple times in the database! Please check database.")
-        elif entry[0] and entry[1]:
+        elif len(entry) > 1:
+            logging.error("Entry found multiple times. Check database!")
+            print("Entry was found multiple times in the database! Please check database.")
+        elif self.dataDiff(data, entry[0]):
             logging.error("Entry found different. Check system!")
             print("Entry was found with different values! Check the system.")
+        else:
+            logging.debug("Entry found")
+            if self.verbose: print(f"Entry was found in the database!\n\t└─{self.uniqueId}: {fetch}\n")
+            return True
         return None
     
     # close the connection with the database